@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Line delimited JSON logs of the changes inserts make to the Atlas
+
+Each log starts with a header line describing the insert, followed by one
+line per change. Changes are appended as chunks of the insert are
+committed, so a log is complete up to the last committed chunk even if
+the insert fails.
+
+Usage:
+`from app.checker.ChangeLog import ChangeLogIndex`
+
+`index = ChangeLogIndex.from_dir("insert_logs")`
+`index.compound("NPA012345")` - every logged change to compound 12345
+`index.reference(678)` - every logged change to reference 678
+"""
+import csv
+import datetime
+import glob
+import json
+import os
+import re
+from collections import defaultdict
+
+
+class Change(object):
+    """
+    Class for tracking changes made to the database
+    """
+    
+    def __init__(self, class_, id_, attr, old_value, new_value,
+                 action="update"):
+        self.class_ = class_
+        self.db_id = id_
+        self.attribute=attr
+        self.old_value = old_value
+        self.new_value = new_value
+        self.action = action
+
+    def to_dict(self):
+        return {"class": self.class_, "db_id": self.db_id,
+                "action": self.action, "attribute": self.attribute,
+                "old_value": self.old_value, "new_value": self.new_value}
+
+
+class ChangeLogWriter(object):
+
+    def __init__(self, path, **header):
+        """Initialize ChangeLogWriter object, opening path for appending
+
+            :path (str) - Log file, created if missing
+
+            kwargs:
+            Written to the header line, e.g. dataset_id and curator
+        """
+        self.path = path
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(path, "a", encoding="utf-8")
+        self._write(dict(header, type="header",
+                         date=datetime.datetime.now().isoformat()))
+
+    def __repr__(self):
+        return "<ChangeLogWriter(path='%s', changes=%d)>" % (
+            self.path, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, change):
+        """Append a Change, buffered until flush"""
+        self._write(dict(change.to_dict(), type="change"))
+        self.count += 1
+
+    def write_many(self, changes):
+        for change in changes:
+            self.write(change)
+        self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def _write(self, record):
+        # default=str covers Decimal and date values from the Atlas
+        self._file.write(json.dumps(record, default=str) + "\n")
+
+
+class ChangeLogIndex(object):
+
+    def __init__(self):
+        # (class, db_id) -> list of change dicts
+        self._changes = defaultdict(list)
+        self.files = []
+
+    def __repr__(self):
+        return "<ChangeLogIndex(files=%d, objects=%d)>" % (
+            len(self.files), len(self._changes))
+
+    def __len__(self):
+        return sum(len(x) for x in self._changes.values())
+
+    @classmethod
+    def from_dir(cls, directory="insert_logs"):
+        """Index every change log in directory, oldest first, including
+        the CSV logs written before logs were JSON
+        """
+        index = cls()
+        for path in sorted(glob.glob(os.path.join(directory, "change_*"))):
+            if path.endswith(".jsonl"):
+                index.add_file(path)
+            elif path.endswith(".log"):
+                index.add_legacy_file(path)
+        return index
+
+    def add_file(self, path):
+        """Index the changes of one log, a truncated last line is skipped"""
+        header = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("type") == "header":
+                    header = record
+                elif record.get("type") == "change":
+                    self._add(dict(record, log=os.path.basename(path),
+                                   dataset_id=header.get("dataset_id")))
+        self.files.append(path)
+
+    def add_legacy_file(self, path):
+        """Index a CSV log, values were not escaped so this is best effort"""
+        with open(path, encoding="utf-8") as f:
+            lines = [x for x in f if not x.startswith("#")]
+        for row in csv.DictReader(lines):
+            try:
+                db_id = int(row["DB_ID"])
+            except (TypeError, ValueError):
+                continue
+            self._add(dict(
+                type="change", action="update", log=os.path.basename(path),
+                dataset_id=None, db_id=db_id, attribute=row["ATTRIBUTE"],
+                old_value=row["OLD_VALUE"], new_value=row["NEW_VALUE"],
+                **{"class": row["CLASS"]}))
+        self.files.append(path)
+
+    def _add(self, record):
+        self._changes[(record["class"], record["db_id"])].append(record)
+
+    def changes(self, class_, db_id):
+        """Logged changes of an Atlas object, in the order they happened"""
+        return list(self._changes.get((class_, int(db_id)), ()))
+
+    def compound(self, npaid):
+        """Changes of a compound by NP Atlas ID, e.g. 12345 or NPA012345"""
+        return self.changes("Compound", npaid_to_id(npaid))
+
+    def reference(self, reference_id):
+        return self.changes("Reference", reference_id)
+
+
+def npaid_to_id(npaid):
+    """Compound id of an NP Atlas ID given as int or NPA string"""
+    if isinstance(npaid, str):
+        match = re.match(r"^\s*(?:NPA)?0*(\d+)\s*$", npaid, re.IGNORECASE)
+        if not match:
+            raise ValueError("Invalid NP Atlas ID: %s" % npaid)
+        return int(match.group(1))
+    return int(npaid)
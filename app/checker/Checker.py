@@ -1,14 +1,23 @@
+import hashlib
+import json
 import logging
 import re
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, or_
 
 from .. import db
-from ..models import (CheckerArticle, CheckerCompound, CheckerDataset, Dataset,
-                      Genus, Journal, Problem, Retraction)
+from ..models import (Article, CheckerArticle, CheckerCompound, CheckerDataset,
+                      Compound, Dataset, Problem, Retraction, article_compound)
 from ..utils import pubchem_search
 from ..utils.atlasdb import atlasdb
-from ..utils.Compound import Compound, inchikey_from_smiles
-from .NameString import NameString, decapitalize_first
+from ..utils.AtlasIndex import AtlasIndex
+from ..utils.batch import chunked
+from ..utils.Compound import structure_record, structure_records
+from .NameString import decapitalize_first, regularize_name
 from .ResolveEnum import ResolveEnum
+from .Resolver import name_key, resolver
 
 # This unit contains far too much tight coupling between checker and flask app
 
@@ -34,6 +43,29 @@ class Checker(object):
         self.logger = kwargs.get("logger") or self.default_logger()
 
         self.review_list = []
+        self.atlas_index = AtlasIndex(self.atlasdb)
+        # Accepted journal and genus names
+        self.resolver = kwargs.get("resolver", resolver)
+        # Load the whole Atlas up front rather than only dataset matches
+        self.preload_atlas = kwargs.get("preload_atlas", False)
+        # Number of articles written per transaction
+        self.batch_size = kwargs.get("batch_size", 1)
+        # Worker processes for RDKit structure processing (None = all cores)
+        self.processes = kwargs.get("processes", None)
+        # Standardization backend (None = STANDARDIZATION_BACKEND variable)
+        self.standardizer = kwargs.get("standardizer", None)
+        self.structures = {}
+        # Compounds left untouched since the previous run when restarting
+        self.unchanged = set()
+        # Source hashes of re-created compounds, saved with their problems
+        self.source_hashes = {}
+        self.saved_problems = {}
+        # Previous check date in incremental runs, to refresh edited articles
+        self.last_check = None
+        # Retracted DOIs, InChIKeys and compound names, loaded per run
+        self.retracted_dois = set()
+        self.retracted_inchikeys = set()
+        self.retracted_names = set()
 
     def update_status(self, current, total, status):
         if self.task:
@@ -45,58 +77,261 @@ class Checker(object):
         self.logger.info("PROGRESS: {}/{}\nStatus: {}"\
                 .format(current, total, status))
 
-    def run(self, standardize_compounds=False, restart=False):
+    def run(self, standardize_compounds=False, restart=False,
+            incremental=False):
         self.logger.info("Setting up dataset")
         dataset = Dataset.query.get_or_404(self.dataset_id)
         total = len(dataset.articles)
-
-        for i, article in enumerate(dataset.get_articles()):
-
-            # Safely skip over previously retracted articles
-            if self.check_reject_article(article):
-                article.is_nparticle = False
-                commit()
-            
-            # Skip over articles which are not properly curated
-            if (not article.completed or article.needs_work 
-                or not article.is_nparticle):
-                self.logger.warning("Skipping article {}!".format(article.id))
-                continue
-
-            check_art = self.create_checker_article(article, restart=restart)
-
-            self.update_status(i, total, check_art.doi)
-            self.check_article(check_art)
-
-            for compound in article.compounds:
-                check_compound = self.create_checker_compound(
-                    compound, standardize=standardize_compounds,
-                    restart=restart)
-                self.check_compound(check_compound)
+        check_date = db.session.query(db.func.current_timestamp()).scalar()
+
+        # Incremental checks only re-check what changed since the last run
+        last_check = dataset.checker_dataset.last_check_date
+        if incremental and not last_check:
+            self.logger.warning("No previous check, checking everything")
+            incremental = False
+        restart = restart or incremental
+        self.last_check = last_check if incremental else None
+
+        self.resolver.refresh()
+        self.load_retractions()
+
+        if self.preload_atlas:
+            self.logger.info("Loading NP Atlas compound index")
+            self.atlas_index.refresh()
+            self.logger.info("Indexed %d NP Atlas compounds",
+                             len(self.atlas_index))
+
+        if restart:
+            self.load_saved_problems()
+
+        articles = dataset.get_articles().all()
+        if incremental:
+            articles = self.skip_unedited_articles(articles, last_check)
+
+        # Stage 0 - compute compound structures in parallel
+        self.logger.info("Processing compound structures")
+        self.structures = self.compute_structures(
+            [c for x in articles if article_ready(x) and not x.inserted
+             for c in x.compounds],
+            standardize=standardize_compounds, restart=restart)
+
+        # Stage 1 - create checker articles and compounds
+        checker_articles = []
+        for batch in chunked(enumerate(articles), self.batch_size):
+            with checker_session_scope():
+                for i, article in batch:
+                    prepared = self.prepare_article(
+                        article, standardize=standardize_compounds,
+                        restart=restart)
+                    if prepared:
+                        self.update_status(
+                            i, total, "Preparing {}".format(prepared[0].doi))
+                        checker_articles.append(prepared)
+
+        # Stage 2 - resolve all NP Atlas matches for the dataset at once
+        self.resolve_atlas_matches(
+            [c for _, compounds in checker_articles for c in compounds
+             if c.id not in self.unchanged])
+
+        # Stage 3 - apply checker rules
+        total = len(checker_articles)
+        for batch in chunked(enumerate(checker_articles), self.batch_size):
+            with checker_session_scope():
+                for i, (check_art, check_compounds) in batch:
+                    self.update_status(i, total, check_art.doi)
+                    self.check_article(check_art)
+
+                    for check_compound in check_compounds:
+                        if check_compound.id in self.unchanged:
+                            self.carry_over_problems(check_compound)
+                        else:
+                            self.check_compound(check_compound)
 
         self.logger.info("Done checking!")
         self.logger.info("There are %d problems to review", len(self.review_list))
-        self.save_review_list()
+        # Committed together with the problems, so a restart only skips
+        # compounds whose problems were saved
+        for _, check_compounds in checker_articles:
+            for check_compound in check_compounds:
+                if check_compound.id in self.source_hashes:
+                    check_compound.source_hash = \
+                        self.source_hashes[check_compound.id]
+        self.save_review_list(diff=restart)
         dataset.checker_dataset.completed = True
         dataset.checker_dataset.running = False
+        dataset.checker_dataset.last_check_date = check_date
         commit()
 
-    def save_review_list(self):
-        counter = 0
-        Problem.query.filter_by(dataset_id=self.dataset_id).delete()
-        commit()
-        for corr in self.review_list:
-            counter += 1
-            prob = Problem(
-                dataset_id=self.dataset_id,
-                problem=corr.problem,
-                article_id=corr.article_id,
-                compound_id=corr.compound_id
+    def skip_unedited_articles(self, articles, last_check):
+        """
+        Carry over the problems of articles which have not been edited
+        since the last check and return the articles left to check
+        """
+        edited_ids = edited_article_ids([x.id for x in articles], last_check)
+        edited = []
+        for article in articles:
+            if article_ready(article) and article.id not in edited_ids:
+                for art_id, problem, comp_id, suggestions in \
+                        self.saved_problems.get(article.id, []):
+                    self.add_problem(art_id, problem, comp_id=comp_id,
+                                     suggestions=suggestions)
+            else:
+                edited.append(article)
+        self.logger.info("Re-checking %d of %d articles",
+                         len(edited), len(articles))
+        return edited
+
+    def prepare_article(self, article, standardize=False, restart=False):
+        """
+        Create the checker article and compounds for a dataset article
+        Return (CheckerArticle, [CheckerCompound]) or None if skipped
+        """
+        # Safely skip over previously retracted articles
+        if self.check_reject_article(article):
+            article.is_nparticle = False
+
+        # Skip over articles which are not properly curated
+        if not article_ready(article):
+            self.logger.warning("Skipping article {}!".format(article.id))
+            return None
+
+        # Committed to the Atlas by an earlier, partial insert
+        if article.inserted:
+            self.logger.info("Article {} already inserted".format(article.id))
+            return None
+
+        # Articles edited since the last check start from a fresh checker
+        # article, so edits and resolved flags are not carried over
+        refresh = bool(self.last_check and
+                       article.edited_since(self.last_check))
+        check_art = self.create_checker_article(
+            article, restart=restart and not refresh)
+        check_compounds = [
+            self.create_checker_compound(
+                compound, standardize=standardize, restart=restart,
+                record=self.structures.get(compound.id))
+            for compound in article.compounds
+        ]
+        return check_art, check_compounds
+
+    def compute_structures(self, compounds, standardize=False, restart=False):
+        """
+        Compute structure records for all compounds which will need a
+        new checker compound, spread across worker processes
+        Return dict of compound id -> structure record
+        """
+        todo = [x for x in compounds
+                if not (restart and x.checker_compound and
+                        x.checker_compound.source_hash == source_hash(x))]
+        jobs = [(x.smiles, regularize_name(x.name), standardize)
+                for x in todo]
+        records = structure_records(jobs, processes=self.processes,
+                                    standardizer=self.standardizer)
+        return {x.id: record for x, record in zip(todo, records)}
+
+    def resolve_atlas_matches(self, checker_compounds):
+        """
+        Load NP Atlas structure and name matches for every compound
+        in a handful of chunked queries rather than several per compound
+        """
+        if not self.atlas_index.loaded:
+            self.atlas_index.load(
+                inchikeys=[x.inchikey for x in checker_compounds],
+                compound_ids=[x.npaid for x in checker_compounds]
             )
+        self.atlas_index.load_names(
+            [x.name for x in checker_compounds if x.name != "Not named"])
 
-            db_add_commit(prob)
+    def load_saved_problems(self):
+        """
+        Keep the unresolved problems from the previous run, grouped by
+        article, so they can be carried over for anything not re-checked
+        """
+        saved = defaultdict(list)
+        problems = Problem.query\
+            .filter_by(dataset_id=self.dataset_id, resolved=False)
+        for prob in problems:
+            saved[prob.article_id].append(
+                (prob.article_id, prob.problem, prob.compound_id,
+                 prob.get_suggestions()))
+        self.saved_problems = saved
+
+    def carry_over_problems(self, checker_compound):
+        art_id = checker_compound.get_article_id()
+        for _, problem, comp_id, suggestions in \
+                self.saved_problems.get(art_id, []):
+            if comp_id == checker_compound.id:
+                self.add_problem(art_id, problem, comp_id=comp_id,
+                                 suggestions=suggestions)
+
+    def save_review_list(self, diff=False):
+        """
+        Write the review list for the dataset in a single transaction
+        using multi-row INSERTs of up to 500 rows
+
+        With diff, problems already saved for the dataset are kept, found
+        again they are reopened with the new suggestions, stale problems
+        are deleted and new problems inserted
+        """
+        rows = [
+            dict(dataset_id=self.dataset_id, problem=corr.problem,
+                 article_id=corr.article_id, compound_id=corr.compound_id,
+                 resolved=False,
+                 suggestions=json.dumps(corr.suggestions)
+                 if corr.suggestions else None)
+            for corr in self.review_list
+        ]
+        query = Problem.query.filter_by(dataset_id=self.dataset_id)
+        with checker_session_scope() as session:
+            if diff:
+                existing = {}
+                # Rows repeating a key are deleted, keeping the first
+                duplicates = []
+                for x in query.with_entities(
+                        Problem.id, Problem.article_id, Problem.compound_id,
+                        Problem.problem, Problem.resolved,
+                        Problem.suggestions).order_by(Problem.id):
+                    key = (x.article_id, x.compound_id, x.problem)
+                    if key in existing:
+                        duplicates.append(x.id)
+                    else:
+                        existing[key] = x
+                keys = {(x["article_id"], x["compound_id"], x["problem"])
+                        for x in rows}
+                stale = [v.id for k, v in existing.items() if k not in keys]
+                # Found again, so unresolved whatever was done before
+                reopened = []
+                for x in rows:
+                    saved = existing.get(
+                        (x["article_id"], x["compound_id"], x["problem"]))
+                    if saved is not None and (
+                            saved.resolved or
+                            saved.suggestions != x["suggestions"]):
+                        reopened.append(dict(problem_id=saved.id,
+                                             suggestions=x["suggestions"]))
+                rows = [x for x in rows
+                        if (x["article_id"], x["compound_id"], x["problem"])
+                        not in existing]
+                for chunk in chunked(stale + duplicates, 500):
+                    Problem.query.filter(Problem.id.in_(chunk))\
+                        .delete(synchronize_session=False)
+                if reopened:
+                    session.execute(
+                        Problem.__table__.update()
+                        .where(Problem.id == bindparam("problem_id"))
+                        .values(resolved=False,
+                                suggestions=bindparam("suggestions")),
+                        reopened)
+                self.logger.info("Keeping %d (reopening %d) and deleting %d "
+                                 "saved problems", len(existing) - len(stale),
+                                 len(reopened), len(stale) + len(duplicates))
+            else:
+                query.delete(synchronize_session=False)
+            # Keep each statement under the MySQL max_allowed_packet
+            for chunk in chunked(rows, 500):
+                session.execute(Problem.__table__.insert().values(chunk))
 
-        self.logger.info("Saved %d problems to DB", counter)
+        self.logger.info("Saved %d problems to DB", len(rows))
 
     def check_article(self, checker_article):
         if not checker_article.resolved:
@@ -111,10 +346,27 @@ class Checker(object):
             self.check_authors(checker_article)
             self.check_title(checker_article)
             self.check_abstract(checker_article)
-            commit()
+
+    def load_retractions(self):
+        """Read the small retractions table once per run"""
+        dois, inchikeys, names = set(), set(), set()
+        for doi, inchikey, name in db.session.query(
+                Retraction.article_doi, Retraction.compound_inchikey,
+                Retraction.compound_name):
+            dois.add(name_key(doi))
+            inchikeys.add(name_key(inchikey))
+            names.add(name_key(name))
+        # Rows only ever match on the fields they have
+        for keys in (dois, inchikeys, names):
+            keys.discard("")
+        self.retracted_dois = dois
+        self.retracted_inchikeys = inchikeys
+        self.retracted_names = names
+        self.logger.info("Loaded %d retracted DOIs, %d InChIKeys and %d names",
+                         len(dois), len(inchikeys), len(names))
 
     def check_reject_article(self, article):
-        return (bool(Retraction.query.filter_by(article_doi=article.doi).all())
+        return (name_key(article.doi) in self.retracted_dois
                 if article.doi else None)
 
     def check_compound(self, checker_compound):
@@ -127,7 +379,6 @@ class Checker(object):
         """
         if self.check_reject_compound(checker_compound):
             checker_compound.resolve = ResolveEnum.reject.value
-            commit()
 
         # If this compound has been checked and resolve don't worry about it's structure
         if not checker_compound.resolve:
@@ -163,23 +414,19 @@ class Checker(object):
                     checker_compound.resolve = ResolveEnum.update.value
 
         self.check_source_organism(checker_compound)
-        commit()
 
     def check_reject_compound(self, compound):
-        res = Retraction.query.filter(Retraction.compound_inchikey==compound.inchikey)\
-                .all()
-        if not res:
-            res = Retraction.query.filter(Retraction.compound_name==compound.name)\
-                    .all()
-        return bool(res)
+        return (name_key(compound.inchikey) in self.retracted_inchikeys or
+                name_key(compound.name) in self.retracted_names)
 
     @staticmethod
     def create_checker_article(article, standardize=False, restart=False):
         # Start fresh if not restarting
         if article.checker_article and not restart:
             db.session.delete(article.checker_article)
-            commit()
-        if not restart:
+            db.session.flush()
+        # Restarts also create those a failed batch rolled back
+        if not (restart and article.checker_article):
             check_art = CheckerArticle(
                 id=article.id,
                 pmid=article.pmid,
@@ -195,58 +442,59 @@ class Checker(object):
                 abstract=article.abstract
             )
 
-            db_add_commit(check_art)
+            db.session.add(check_art)
         else:
             check_art = article.checker_article
 
         return check_art
 
     def create_checker_compound(self, db_compound, standardize=False, 
-                                restart=False):
-        # If restarting check if anything was changed in the dataset
-        restart_changed = False
-        if restart and db_compound.checker_compound:
-            if inchikey_from_smiles(db_compound.smiles) != db_compound.checker_compound.inchikey:
-                self.logger.warning("Re-creating compound because structure changed!")
-                restart_changed = True
-            
-        # Start fresh if not restarting
-        if (db_compound.checker_compound and not restart) or restart_changed:
-            db.session.delete(db_compound.checker_compound)
-            commit()
-
-        # Regularize the name
-        # Especially important for "not named" or similar
-        reg_name = NameString(db_compound.name)
-        reg_name.regularize_name()
-
-        # Currently not standardizing because it takes ~10x longer
-        reg_compound = Compound(
-            db_compound.smiles,
-            name=reg_name.get_name(),
-            standardize=standardize
-        )
-        reg_compound.cleanStructure()
+                                restart=False, record=None):
+        compound_hash = source_hash(db_compound)
+        check_compound = db_compound.checker_compound
 
-        genus, species = split_source_organism(db_compound.source_organism)
-        if not restart or restart_changed:
-            check_compound = CheckerCompound(
-                id=db_compound.id,
-                name=reg_name.get_name(),
-                formula=reg_compound.formula,
-                smiles=reg_compound.smiles,
-                inchi=reg_compound.inchi,
-                inchikey=reg_compound.inchikey,
-                molblock=reg_compound.molblock,
-                source_genus=genus,
-                source_species=species,
-                npaid=db_compound.npaid
+        # If restarting check if anything was changed in the dataset
+        if restart and check_compound:
+            if check_compound.source_hash == compound_hash:
+                self.unchanged.add(check_compound.id)
+                return check_compound
+            elif check_compound.source_hash is None:
+                self.logger.warning("Re-creating compound an earlier run "
+                                    "did not finish checking")
+            else:
+                self.logger.warning("Re-creating compound because it changed!")
+
+        # Start fresh if not restarting or compound was changed
+        if check_compound:
+            db.session.delete(check_compound)
+            db.session.flush()
+
+        if not record:
+            # The rdkit and hybrid standardization backends avoid most
+            # PubChem round trips
+            record = structure_record(
+                db_compound.smiles,
+                name=regularize_name(db_compound.name),
+                standardize=standardize,
+                standardizer=self.standardizer
             )
-            self.parse_external_ids(check_compound, db_compound)
+        genus, species = split_source_organism(db_compound.source_organism)
+        check_compound = CheckerCompound(
+            id=db_compound.id,
+            name=record.name,
+            formula=record.formula,
+            smiles=record.smiles,
+            inchi=record.inchi,
+            inchikey=record.inchikey,
+            molblock=record.molblock,
+            source_genus=genus,
+            source_species=species,
+            npaid=db_compound.npaid
+        )
+        self.source_hashes[db_compound.id] = compound_hash
+        self.parse_external_ids(check_compound, db_compound)
 
-            db_add_commit(check_compound)
-        else:
-            check_compound = db_compound.checker_compound
+        db.session.add(check_compound)
 
         return check_compound
 
@@ -277,10 +525,11 @@ class Checker(object):
             format='%(levelname)s: %(message)s',
             level=logging.getLevelName(level)
         )
+        return logging.getLogger(__name__)
 
-    def add_problem(self, art_id, problem, comp_id=None):
+    def add_problem(self, art_id, problem, comp_id=None, suggestions=None):
         self.review_list.append(
-                Correction(art_id, problem, comp_id)
+                Correction(art_id, problem, comp_id, suggestions)
         )
 
     ## Start Checker Rules
@@ -299,12 +548,15 @@ class Checker(object):
         pass
         
     def check_journal(self, checker_article):
-        journal = Journal.check_journal_match(checker_article.journal)
+        journal = self.resolver.match_journal(checker_article.journal)
         if journal:
             checker_article.journal = journal.journal
             checker_article.journal_abbrev = journal.abbrev
         else:
-            self.add_problem(checker_article.id, "journal")
+            self.add_problem(
+                checker_article.id, "journal",
+                suggestions=self.resolver.suggest_journal(
+                    checker_article.journal))
         
     def check_year(self, checker_article):
         # Make sure year string is valid
@@ -368,13 +620,15 @@ class Checker(object):
                 self.add_problem(checker_article.id, "abstract")
 
     def check_source_organism(self, checker_compound):
-        genus = Genus.check_genus_match(checker_compound.source_genus)
+        genus = self.resolver.match_genus(checker_compound.source_genus)
         if genus:
-            checker_compound.source_genus = genus.genus
+            checker_compound.source_genus = genus
         else:
-
-            self.add_problem(checker_compound.get_article_id(), "genus",
-                             comp_id=checker_compound.id)
+            self.add_problem(
+                checker_compound.get_article_id(), "genus",
+                comp_id=checker_compound.id,
+                suggestions=self.resolver.suggest_genus(
+                    checker_compound.source_genus))
 
     def check_article_duplicate(self, check_article):
         if not check_article.npa_artid:
@@ -384,63 +638,43 @@ class Checker(object):
                 npart_id = self.npa_artid_from_article_doi(check_article)
                 if npart_id:
                     check_article.npa_artid = npart_id
-                    commit()
             if not npart_id:
                 npart_id = self.npa_artid_from_article_title(check_article)
                 if npart_id:
                     check_article.npa_artid = npart_id
-                    commit()
 
     def compound_flat_match(self, compound):
         """
-        Query NP Atlas DB to see if there is a flat match
+        Check NP Atlas index to see if there is a flat match
         Return boolean match 
         """
-        sess = self.atlasdb.startSession()
-        res = sess.query(atlasdb.Compound)\
-            .filter(atlasdb.Compound.inchikey.startswith(compound.inchikey.split('-')[0]))\
-            .first()
-        sess.close()
-        return bool(res)
+        return self.atlas_index.has_block(compound.inchikey)
 
     def compound_full_match(self, compound):
         """
-        Query NP Atlas DB to see if there is a full match
+        Check NP Atlas index to see if there is a full match
         Return boolean match 
         """
-        sess = self.atlasdb.startSession()
-        res = sess.query(atlasdb.Compound)\
-            .filter(atlasdb.Compound.inchikey == compound.inchikey)\
-            .first()
-        sess.close()
-        return bool(res)
+        return self.atlas_index.has_inchikey(compound.inchikey)
 
     def compound_name_match(self, compound):
         """
-        Query NP Atlas DB to see if there is a name match
+        Check NP Atlas index to see if there is a name match
         Return boolean match 
         """
-        res = None
+        res = False
         if compound.name != "Not named":
-            sess = self.atlasdb.startSession()
-            res = sess.query(atlasdb.Name)\
-                    .filter(atlasdb.Name.name == compound.name)\
-                    .first()
-            sess.close()
-        return bool(res)
+            res = self.atlas_index.has_name(compound.name)
+        return res
 
     def npaid_changed(self, compound):
         """
-        Query NP Atlas DB to see if a compound has changed in 
+        Check NP Atlas index to see if a compound has changed in 
         structure
         Return boolean
         """
-        sess = self.atlasdb.startSession()
-        res = sess.query(atlasdb.Compound)\
-                .filter_by(id=compound.npaid)\
-                .first()
-        sess.close()
-        match = compound.inchikey != res.inchikey if res else True
+        atlas_inchikey = self.atlas_index.get_inchikey(compound.npaid)
+        match = compound.inchikey != atlas_inchikey if atlas_inchikey else True
         return match
 
     def npa_artid_from_article_doi(self, article):
@@ -475,11 +709,13 @@ class Correction(object):
     Object to store data which needs review
     """
 
-    def __init__(self, art_id, problem, comp_id=None):
+    def __init__(self, art_id, problem, comp_id=None, suggestions=None):
         self.verify_problem(problem)
         self.article_id = art_id
         self.compound_id = comp_id
         self.problem = problem
+        # Ranked corrections offered when resolving, list of dicts
+        self.suggestions = suggestions or []
 
     def __repr__(self):
         return "{} -> {}".format(self.article_id + self.compound_id, self.problem)
@@ -500,6 +736,17 @@ class Correction(object):
 # ==========                Helper functions                      =============
 # =============================================================================
 
+@contextmanager
+def checker_session_scope():
+    """Commit a batch of checker writes once, rolling back only that batch"""
+    try:
+        yield db.session
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+
 def db_add_commit(db_object):
     db.session.add(db_object)
     commit()
@@ -513,6 +760,51 @@ def commit():
         raise e
 
 
+def article_ready(article):
+    """
+    Check an article is properly curated and should be checked
+    """
+    return (article.completed and not article.needs_work
+            and article.is_nparticle)
+
+
+def edited_article_ids(article_ids, timestamp):
+    """
+    Ids of the articles edited after timestamp, with a compound edited
+    after timestamp, or with anything not checked yet, in two queries per
+    chunk of article ids
+    """
+    edited = set()
+    for chunk in chunked(article_ids, 500):
+        articles = db.session.query(Article.id)\
+            .outerjoin(CheckerArticle, CheckerArticle.id == Article.id)\
+            .filter(Article.id.in_(chunk))\
+            .filter(or_(CheckerArticle.id.is_(None),
+                        Article.last_edit_date > timestamp))
+        compounds = db.session.query(article_compound.c.article_id)\
+            .join(Compound, Compound.id == article_compound.c.compound_id)\
+            .outerjoin(CheckerCompound, CheckerCompound.id == Compound.id)\
+            .filter(article_compound.c.article_id.in_(chunk))\
+            .filter(or_(CheckerCompound.id.is_(None),
+                        Compound.last_edit_date > timestamp))
+        edited.update(x for x, in articles)
+        edited.update(x for x, in compounds)
+    return edited
+
+
+def source_hash(db_compound):
+    """
+    Hash the curated data a checker compound is built from so restarts
+    can detect changes without any RDKit work
+    """
+    digest = hashlib.sha1()
+    for value in (db_compound.smiles, db_compound.name,
+                  db_compound.source_organism):
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
 def find_mibig_id(note):
     """
     Search note string for BGC string
@@ -1,13 +1,24 @@
 import datetime
+import hashlib
+import json
 import os
+from collections import Counter
 from contextlib import contextmanager
 from decimal import Decimal
 
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy.orm.interfaces import MANYTOONE
+
 from .. import db
 from ..models import Dataset, Genus, Journal
 from ..utils.atlasdb import atlasdb
+from ..utils.batch import chunked
 from ..utils.Compound import Compound
+from .ChangeLog import Change, ChangeLogWriter
+from .Checker import article_ready
 from .ResolveEnum import ResolveEnum
+from .Resolver import name_key
 
 
 class Inserter(object):
@@ -30,7 +41,28 @@ class Inserter(object):
 
         self.task = kwargs.get("celery_task", None)
         self.logger = kwargs.get("logger")
+        # Changes and new compounds and references not committed yet
         self.changes = []
+        self.inserted = []
+        self.change_log = None
+        self.log_dir = kwargs.get("log_dir", "insert_logs")
+        # Maximum number of values per IN (...) lookup
+        self.chunk_size = kwargs.get("chunk_size", 500)
+        # Articles committed to the Atlas per transaction
+        self.articles_per_commit = kwargs.get("articles_per_commit", 10)
+        # Lookups resolved up front by prefetch
+        self.records = {}
+        self.origin_types = {}
+        self.atlas_inchikeys = set()
+        self.names = {}
+        self.genera = {}
+        self.origins = {}
+        self.journals = {}
+        self.atlas_compounds = {}
+        self.references = {}
+        self.original_names = {}
+        self.original_origins = {}
+        self.origin_compound_counts = {}
 
     def update_status(self, current, total, status):
         if self.task:
@@ -42,105 +74,380 @@ class Inserter(object):
         self.logger.info("PROGRESS: {}/{}\nStatus: {}"\
                 .format(current, total, status))
 
-    def run(self):
+    def run(self, digest=None):
+        """
+        Insert the dataset into the Atlas, committing a chunk of articles
+        at a time. Articles committed by an earlier, failed run are
+        skipped so the insert resumes where it stopped
+
+            :digest (str) - Default = None - Digest of a reviewed plan, the
+                            insert is rejected if its plan differs
+
+        The digest is checked in the transaction of the first chunk, so
+        that chunk is written from the Atlas that was checked. Later
+        chunks are separate transactions and could still see concurrent
+        Atlas changes. A resumed insert skips the committed articles, so
+        its plan never matches the digest of the original plan
+        """
         dataset = Dataset.query.get(self.dataset_id)
 
         self.dataset_sanity_check(dataset)
-        total = len(dataset.articles)
+        articles = self.pending_articles(dataset)
+        total = len(articles)
         self.update_status(0, total, 'FIRING UP')
         # Start a session scope
         with atlas_session_scope() as session:
-            
-            # Iterate over checker_articles, double check the article is good
-            # Add/update the data
-            for idx, ds_article in enumerate(dataset.articles):
-                # Skip over articles which are not properly curated/checked
-                if (not ds_article.completed or ds_article.needs_work 
-                    or not ds_article.is_nparticle):
-                    self.logger.warning("Skipping article {}!".format(ds_article.id))
-                    continue
-
-                self.update_status(idx, total, "RUNNING")
-
-                c_article = ds_article.checker_article
-
-                if not c_article.npa_artid:
-                    self.logger.info("Adding Reference - {}"\
-                                     .format(c_article.doi))
-                    reference = self.new_reference(c_article, session)
-                else:
-                    self.logger.info("Updating Reference {} - {}"\
-                                     .format(c_article.npa_artid, c_article.doi))
-                    reference = self.update_reference(c_article, session)
-
-                # Iterate over compounds and add/update them
-                # These functions also do association with origin + reference
-                for ds_compound in ds_article.compounds:
-                    c_compound = ds_compound.checker_compound
-
-                    # Double check compound doesn't match Atlas without being handled
-                    if (self.check_atlas_match(c_compound, session)
-                        and not c_compound.resolve):
-                        self.logger.error("Found an uncaught match for a compound!")
-                        self.logger.error("{} - {}".format(
-                                            c_compound.name, c_compound.inchikey))
-                        self.reject_dataset()
-
-                    # Assume new if no resolve enum value in DB
-                    resolve_id = c_compound.resolve or 1 
-                    resolve = ResolveEnum(resolve_id)
-                    self.logger.debug("Resolving {} by {}-ing"\
-                                     .format(c_compound.id, resolve.name))
-
-                    if resolve.name == "new":
-                        self.logger.info("Adding new compound: {}"\
-                                         .format(c_compound.name))
-                        self.new_compound(c_compound, reference, session)
-
-                    elif resolve.name == "keep":
-                        self.logger.info("Keeping NP Atlas Compound {}"\
-                                         .format(c_compound.name))
-                        continue
-
-                    elif resolve.name == "replace" or resolve.name == "update":
-                        self.logger.info("Replacing NPAID: {}"\
-                                         .format(c_compound.npaid))
-                        self.update_compound(c_compound, reference, session)
-                    
-                    else: # Only possible if mis-handled reject during checking
-                        self.logger.error("Dataset contains rejected compounds - "+
-                                          "There was an error in checker handling...")
-                        self.reject_dataset()
-        self.logger.info("Recorded {} changes".format(len(self.changes)))
-        self.write_change_log(dataset)
+            # Prefetched objects stay usable after each chunk's commit
+            session.expire_on_commit = False
+            if digest and self.dry_run(articles, session)["digest"] != digest:
+                self.logger.error("Insert no longer matches the reviewed plan")
+                self.reject_dataset(
+                    "Insert no longer matches the reviewed plan, preview it "
+                    "again. Inserts resumed after a failure always need a "
+                    "new preview")
+            # Prefetched again, the dry run left new objects in the lookups
+            self.prepare(articles, session)
+            with self.open_change_log(dataset) as self.change_log:
+                for idx, chunk in enumerate(
+                        chunked(articles, self.articles_per_commit)):
+                    self.update_status(idx * self.articles_per_commit,
+                                       total, "RUNNING")
+                    self.insert_chunk(chunk, session)
+        self.logger.info("Recorded {} changes".format(self.change_log.count))
         dataset.checker_dataset.inserted = True
         try:
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             raise e
+
+    def insert_chunk(self, articles, session):
+        """
+        Insert articles in one transaction, committed only if all of them
+        were inserted. A failure rolls back the whole chunk and is raised
+        """
+        inserted = []
+        try:
+            for article in articles:
+                reference = self.insert_article(article, session)
+                inserted.append((article, reference))
+            session.commit()
+        except Exception:
+            session.rollback()
+            self.changes = []
+            self.inserted = []
+            raise
+        self.log_committed()
+        # Kept on the article, which re-checks do not recreate
+        for article, reference in inserted:
+            article.inserted = True
+            article.npa_artid = reference.id
+            article.checker_article.npa_artid = reference.id
+        db.session.commit()
+        self.logger.info("Committed {} articles".format(len(inserted)))
+
+    def plan(self):
+        """
+        Dry run of the insert, returns the plan of every insert and update
+        it would make and leaves the Atlas and the dataset untouched
+        """
+        dataset = Dataset.query.get(self.dataset_id)
+
+        self.dataset_sanity_check(dataset)
+        articles = self.pending_articles(dataset)
+        session = atlasdb.startSession()
+        try:
+            plan = self.dry_run(articles, session)
+        finally:
+            session.rollback()
+            session.close()
+        self.logger.info("Planned {} inserts and {} updates".format(
+            len(plan["inserts"]), len(plan["updates"])))
+        return plan
+
+    def dry_run(self, articles, session):
+        """
+        Plan of inserting articles, made under a SAVEPOINT of session
+        which is rolled back so the transaction stays open
+        """
+        self.prepare(articles, session)
+        savepoint = session.begin_nested()
+        try:
+            for article in articles:
+                self.insert_article(article, session)
+            return self.collect_plan(session)
+        finally:
+            savepoint.rollback()
+            self.changes = []
+            self.inserted = []
+
+    def pending_articles(self, dataset):
+        """Articles ready for insertion which are not inserted yet"""
+        articles = []
+        for ds_article in dataset.articles:
+            # Skip over articles which are not properly curated/checked
+            if not article_ready(ds_article):
+                self.logger.warning("Skipping article {}!".format(ds_article.id))
+            elif ds_article.inserted:
+                self.logger.info("Article {} already inserted"\
+                                 .format(ds_article.id))
+            else:
+                articles.append(ds_article)
+        return articles
+
+    def prepare(self, articles, session):
+        # Structures are computed before the first Atlas query opens the
+        # transaction
+        self.compute_records(articles)
+        self.prefetch(articles, session)
+
+    def insert_article(self, ds_article, session):
+        """
+        Add or update an article and its compounds in session, returns
+        the Atlas reference
+        """
+        c_article = ds_article.checker_article
+
+        if not c_article.npa_artid:
+            self.logger.info("Adding Reference - {}"\
+                             .format(c_article.doi))
+            reference = self.new_reference(c_article, session)
+        else:
+            self.logger.info("Updating Reference {} - {}"\
+                             .format(c_article.npa_artid, c_article.doi))
+            reference = self.update_reference(c_article, session)
+
+        # Iterate over compounds and add/update them
+        # These functions also do association with origin + reference
+        for ds_compound in ds_article.compounds:
+            c_compound = ds_compound.checker_compound
+
+            # Double check compound doesn't match Atlas without being handled
+            if (self.check_atlas_match(c_compound, session)
+                and not c_compound.resolve):
+                self.logger.error("Found an uncaught match for a compound!")
+                self.logger.error("{} - {}".format(
+                                    c_compound.name, c_compound.inchikey))
+                self.reject_dataset()
+
+            # Assume new if no resolve enum value in DB
+            resolve_id = c_compound.resolve or 1 
+            resolve = ResolveEnum(resolve_id)
+            self.logger.debug("Resolving {} by {}-ing"\
+                             .format(c_compound.id, resolve.name))
+
+            if resolve.name == "new":
+                self.logger.info("Adding new compound: {}"\
+                                 .format(c_compound.name))
+                self.new_compound(c_compound, reference, session)
+
+            elif resolve.name == "keep":
+                self.logger.info("Keeping NP Atlas Compound {}"\
+                                 .format(c_compound.name))
+                continue
+
+            elif resolve.name == "replace" or resolve.name == "update":
+                self.logger.info("Replacing NPAID: {}"\
+                                 .format(c_compound.npaid))
+                self.update_compound(c_compound, reference, session)
             
-    def write_change_log(self, dataset):
+            else: # Only possible if mis-handled reject during checking
+                self.logger.error("Dataset contains rejected compounds - "+
+                                  "There was an error in checker handling...")
+                self.reject_dataset()
+
+        return reference
+
+    def collect_plan(self, session):
+        """
+        Describe the pending inserts and updates of session, the session
+        is not flushed so nothing is written
+
+        Returns a JSON serializable dict, "digest" identifies the plan
+        """
+        # New objects have no id yet, number them per class instead
+        new = sorted(session.new, key=lambda x: inspect(x).insert_order)
+        counts = Counter()
+        labels = {}
+        for obj in new:
+            counts[type(obj).__name__] += 1
+            labels[id(obj)] = "new {} {}".format(
+                type(obj).__name__, counts[type(obj).__name__])
+
+        inserts = [
+            dict(object=labels[id(obj)], values=pending_values(obj, labels))
+            for obj in new
+        ]
+        updates = []
+        for obj in sorted(session.dirty, key=object_label):
+            for attr, (old_value, new_value) in \
+                    sorted(changed_values(obj, labels).items()):
+                updates.append(dict(object=object_label(obj), attribute=attr,
+                                    old_value=old_value, new_value=new_value))
+        plan = dict(dataset_id=self.dataset_id, inserts=inserts,
+                    updates=updates)
+        plan["digest"] = hashlib.sha1(
+            json.dumps(plan, sort_keys=True).encode("utf-8")).hexdigest()
+        return plan
+
+    def compute_records(self, articles):
+        """Structure record of every compound to insert, by checker id"""
+        for article in articles:
+            for c in article.compounds:
+                compound = c.checker_compound
+                # Kept from a dry run before the insert
+                if (compound.id not in self.records and
+                        compound.resolve != ResolveEnum.keep.value):
+                    self.records[compound.id] = Compound(
+                        compound.smiles, name=compound.name).to_record()
+
+    def structure_record(self, compound):
+        record = self.records.get(compound.id)
+        if record is None:
+            record = Compound(compound.smiles, name=compound.name).to_record()
+        return record
+
+    def prefetch(self, articles, session):
+        """
+        Resolve the names, origins, genera, journals and existing
+        compounds used by the dataset with a few bulk queries, instead
+        of several queries per compound while inserting
+
+        Keys are case insensitive, as the lookups in MySQL were
+        """
+        compounds = [c.checker_compound for x in articles for c in x.compounds]
+        updated = [x for x in compounds if x.npaid and x.resolve in (
+            ResolveEnum.replace.value, ResolveEnum.update.value)]
+        genera = {x.source_genus for x in compounds if x.source_genus}
+        species = {x.source_species for x in compounds if x.source_genus}
+
+        self.origin_types = {}
+        for genus in self.bulk_query(
+                db.session.query(Genus).order_by(Genus.id),
+                Genus.genus, genera):
+            self.origin_types.setdefault(
+                name_key(genus.genus), genus.genustype.split('_')[0])
+
+        self.atlas_inchikeys = {
+            x for x, in self.bulk_query(
+                session.query(atlasdb.Compound.inchikey),
+                atlasdb.Compound.inchikey,
+                {x.inchikey for x in compounds if x.inchikey})
+        }
+
+        self.names = {}
+        for name in self.bulk_query(
+                session.query(atlasdb.Name).order_by(atlasdb.Name.id),
+                atlasdb.Name.name, {x.name for x in compounds if x.name}):
+            self.names.setdefault(name_key(name.name), name)
+
+        self.genera = {}
+        for genus in self.bulk_query(
+                session.query(atlasdb.Genus).order_by(atlasdb.Genus.id),
+                atlasdb.Genus.name, genera):
+            self.genera.setdefault(
+                (name_key(genus.name), genus.origin_type_id), genus)
+
+        self.origins = {}
+        origins = session.query(atlasdb.Origin)\
+            .join(atlasdb.Genus)\
+            .options(contains_eager(atlasdb.Origin.genus))\
+            .order_by(atlasdb.Origin.id)
+        # Compounds without a species match origins with a NULL species
+        species_filters = [
+            atlasdb.Origin.species.in_(chunk) for chunk in chunked(
+                sorted(x for x in species if x is not None), self.chunk_size)
+        ]
+        if None in species:
+            species_filters.append(atlasdb.Origin.species.is_(None))
+        found = []
+        for species_filter in species_filters:
+            found.extend(self.bulk_query(origins.filter(species_filter),
+                                         atlasdb.Genus.name, genera))
+        for origin in sorted(found, key=lambda x: x.id):
+            self.origins.setdefault(
+                origin_key(origin.genus.name, origin.species), origin)
+
+        self.journals = {}
+        for journal in self.bulk_query(
+                session.query(atlasdb.Journal).order_by(atlasdb.Journal.id),
+                atlasdb.Journal.title,
+                {x.checker_article.journal for x in articles
+                 if x.checker_article.journal}):
+            self.journals.setdefault(name_key(journal.title), journal)
+
+        # Keep the rows to update in the session's identity map
+        self.atlas_compounds = {
+            x.id: x for x in self.bulk_query(
+                session.query(atlasdb.Compound), atlasdb.Compound.id,
+                {x.npaid for x in updated})
+        }
+        self.references = {
+            x.id: x for x in self.bulk_query(
+                session.query(atlasdb.Reference), atlasdb.Reference.id,
+                {x.checker_article.npa_artid for x in articles
+                 if x.checker_article.npa_artid})
+        }
+
+        self.original_names = {
+            x.compound_id: x.name for x in self.bulk_query(
+                session.query(atlasdb.CompoundName)
+                .options(joinedload(atlasdb.CompoundName.name))
+                .filter(atlasdb.CompoundName.original_isolation_name == 1),
+                atlasdb.CompoundName.compound_id, self.atlas_compounds)
+        }
+        self.original_origins = {
+            x.compound_id: x.origin for x in self.bulk_query(
+                session.query(atlasdb.CompoundOrigin)
+                .options(joinedload(atlasdb.CompoundOrigin.origin)
+                         .joinedload(atlasdb.Origin.genus))
+                .filter(
+                    atlasdb.CompoundOrigin.original_isolation_reference == 1),
+                atlasdb.CompoundOrigin.compound_id, self.atlas_compounds)
+        }
+        self.origin_compound_counts = dict(self.bulk_query(
+            session.query(atlasdb.CompoundOrigin.origin_id, func.count())
+            .group_by(atlasdb.CompoundOrigin.origin_id),
+            atlasdb.CompoundOrigin.origin_id,
+            {x.id for x in self.original_origins.values()}))
+
+        self.logger.info(
+            "Prefetched %d names, %d genera, %d origins, %d journals and "
+            "%d existing compounds", len(self.names), len(self.genera),
+            len(self.origins), len(self.journals),
+            len(self.atlas_inchikeys) + len(self.atlas_compounds))
+
+    def bulk_query(self, query, column, values):
+        """Rows of query where column is in values, chunking the IN list"""
+        results = []
+        for chunk in chunked(sorted(values), self.chunk_size):
+            results.extend(query.filter(column.in_(chunk)).all())
+        return results
+
+    def open_change_log(self, dataset):
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        outdir = os.path.realpath("insert_logs")
-        info = "# Curator {} = {}\n# Insert Date: {}".format(
-            dataset.curator_id, dataset.curator.username, 
-            timestamp)
-        header = '"CLASS","DB_ID","ATTRIBUTE","OLD_VALUE","NEW_VALUE"'
-        if not os.path.isdir(outdir):
-            os.mkdir(outdir)
-        outfile = os.path.join(outdir, "change_{}.log".format(timestamp))
-        lines = [info, header] + [x.to_string() for x in self.changes]
+        outfile = os.path.join(os.path.realpath(self.log_dir),
+                               "change_{}.jsonl".format(timestamp))
         self.logger.debug("Writing change log to {}".format(outfile))
-        with open(outfile, 'w') as f:
-            f.write("\n".join(lines))
+        return ChangeLogWriter(
+            outfile, dataset_id=dataset.id, curator_id=dataset.curator_id,
+            curator=dataset.curator.username if dataset.curator else None)
+
+    def log_committed(self):
+        """Write the changes of the last commit to the change log"""
+        changes = [Change(type(x).__name__, x.id, None, None, None,
+                          action="insert") for x in self.inserted]
+        if self.change_log:
+            self.change_log.write_many(changes + self.changes)
+        self.inserted = []
+        self.changes = []
 
     def new_compound(self, compound, reference, session):
         """
         Add a new compound to the NP Atlas and associate origin with reference
         """
-        # Generate RDKit molecule with precomputed data
-        calc_compound = Compound(compound.smiles, name=compound.name)
+        # Precomputed structure data, the RDKit molecule is not kept
+        calc_compound = self.structure_record(compound)
         
         # Prepare necessary data
         curation_data = atlasdb.CurationData(
@@ -168,6 +475,7 @@ class Inserter(object):
                     atlasdb.ExternalDB(db_code=id_, db_id=v)
                 )
         session.add(db_compound)
+        self.inserted.append(db_compound)
 
         self.associate_compound_name(db_compound, name, reference, session, new=True)
         self.associate_compound_origin(db_compound, origin, reference, session, new=True)
@@ -176,10 +484,11 @@ class Inserter(object):
         """
         Update compound in NP Atlas and associate origin with reference
         """
-        # Generate RDKit molecule with precomputed data
-        calc_compound = Compound(compound.smiles, name=compound.name)
+        # Precomputed structure data, the RDKit molecule is not kept
+        calc_compound = self.structure_record(compound)
         
-        db_compound = session.query(atlasdb.Compound).get(compound.npaid)
+        db_compound = (self.atlas_compounds.get(compound.npaid) or
+                       session.query(atlasdb.Compound).get(compound.npaid))
         if not db_compound:
             self.logger.error("Compound was not found in the Atlas!")
             self.reject_dataset()
@@ -213,7 +522,8 @@ class Inserter(object):
                 )
 
         # Update and save original isolation name
-        name = db_compound.original_name
+        name = (self.original_names.get(db_compound.id) or
+                db_compound.original_name)
         if name.name != compound.name:
             if name.name != "Not named":
                 self.save_update(name, "name", compound.name)
@@ -223,12 +533,13 @@ class Inserter(object):
                                          new=False)
 
         # Update and save original isolation origin
-        origin = db_compound.original_origin
+        origin = (self.original_origins.get(db_compound.id) or
+                  db_compound.original_origin)
         if origin.genus.name != compound.source_genus:
             if not self.origin_has_many_compounds(origin, session):
                 origin_type_id = self.get_origin_type_id(compound.source_genus)
-                genus = atlasdb.getGenus(compound.source_genus, origin_type_id,
-                                        session)
+                genus = self.get_genus(compound.source_genus, origin_type_id,
+                                       session)
                 self.save_update(origin, "genus_id", genus.id)
                 self.save_update(origin, "species", compound.source_species)
             else:
@@ -237,6 +548,8 @@ class Inserter(object):
                                            new=False)
     
     def origin_has_many_compounds(self, origin, session):
+        if origin.id in self.origin_compound_counts:
+            return self.origin_compound_counts[origin.id] > 1
         res = session.query(atlasdb.CompoundOrigin)\
             .filter(atlasdb.CompoundOrigin.origin_id == origin.id)\
             .all()
@@ -281,28 +594,20 @@ class Inserter(object):
 
     def get_compound_name(self, name_string, session):
         # Get or create name
-        name = session.query(atlasdb.Name)\
-            .filter_by(name=name_string)\
-            .first()
+        name = self.names.get(name_key(name_string))
         if not name:
             name = atlasdb.Name(name=name_string)
             session.add(name)
+            self.names[name_key(name_string)] = name
         return name
 
     def check_atlas_match(self, compound, session):
-        result = session.query(atlasdb.Compound)\
-            .filter(atlasdb.Compound.inchikey == compound.inchikey)\
-            .first()
-        return bool(result)
+        return compound.inchikey in self.atlas_inchikeys
 
     def get_origin(self, compound, session):
         origin_type_name = self.get_origin_type_name(compound.source_genus)
-        origin = session.query(atlasdb.Origin)\
-            .filter((atlasdb.Genus.name == compound.source_genus) &
-                    (atlasdb.Origin.genus_id == atlasdb.Genus.id) &
-                    (atlasdb.OriginType.name == origin_type_name) &
-                    (atlasdb.Origin.species == compound.source_species))\
-            .first()
+        key = origin_key(compound.source_genus, compound.source_species)
+        origin = self.origins.get(key)
         if not origin:
             if origin_type_name == 'Bacterium':
                 origin_type_id = 1
@@ -311,16 +616,32 @@ class Inserter(object):
             else: # This indicates an error
                 self.logger.error("Origin type is not Bacterium or Fungus")
                 self.reject_dataset()
-            genus = atlasdb.getGenus(compound.source_genus, origin_type_id,
-                                     session)
+            genus = self.get_genus(compound.source_genus, origin_type_id,
+                                   session)
             origin = atlasdb.Origin(
                 genus=genus,
                 species=compound.source_species
             )
             session.add(origin)
+            self.origins[key] = origin
         return origin
 
+    def get_genus(self, genus_name, origin_type_id, session):
+        key = (name_key(genus_name), origin_type_id)
+        if key not in self.genera:
+            self.genera[key] = atlasdb.getGenus(genus_name, origin_type_id,
+                                                session)
+        return self.genera[key]
+
+    def get_journal(self, title, abbrev, session):
+        if name_key(title) not in self.journals:
+            self.journals[name_key(title)] = atlasdb.getJournal(
+                title, abbrev, session)
+        return self.journals[name_key(title)]
+
     def get_origin_type_name(self, genus_string):
+        if name_key(genus_string) in self.origin_types:
+            return self.origin_types[name_key(genus_string)]
         genus = Genus.query.filter_by(genus=genus_string).first()
         return genus.genustype.split('_')[0]
 
@@ -337,8 +658,8 @@ class Inserter(object):
         Add a new article and add it to the session
         """
         # Get required associated data first
-        journal = atlasdb.getJournal(article.journal, article.journal_abbrev,
-                                     session)
+        journal = self.get_journal(article.journal, article.journal_abbrev,
+                                   session)
         ref_type = session.query(atlasdb.ReferenceType).get(1) # Journal article
         ref = atlasdb.Reference(
             authors=article.authors,
@@ -354,13 +675,15 @@ class Inserter(object):
             abstract=article.abstract
         )
         session.add(ref)
+        self.inserted.append(ref)
         return ref
 
     def update_reference(self, article, session):
         """
         Get an article and update the data
         """
-        ref = session.query(atlasdb.Reference).get(article.npa_artid)
+        ref = (self.references.get(article.npa_artid) or
+               session.query(atlasdb.Reference).get(article.npa_artid))
         if not ref:
             self.logger.error("Reference was not found in the Atlas!")
             self.reject_dataset()
@@ -368,8 +691,8 @@ class Inserter(object):
         # Double check Journal matches
         if ref.journal.title != article.journal:
             self.logger.warn("Journal does not match with NP Atlas.")
-            journal = atlasdb.getJournal(article.journal, article.journal_abbrev,
-                                         session)
+            journal = self.get_journal(article.journal, article.journal_abbrev,
+                                       session)
             self.save_update(ref, "journal_id", journal.id)
 
         # Update the rest of the data
@@ -432,10 +755,63 @@ class Inserter(object):
             self.reject_dataset()
         self.logger.debug("Passed Third Sanity Check!")
 
-    def reject_dataset(self):
+    def reject_dataset(self, reason="Dataset is not ready for insertion"):
         db.session.rollback()
-        self.atlasdb.engine.dispose()
-        raise RuntimeError("Dataset is not ready for insertion")
+        raise RuntimeError(reason)
+
+
+def origin_key(genus, species):
+    """Case insensitive key of an Atlas origin"""
+    return (name_key(genus), name_key(species))
+
+
+def object_label(obj, labels=None):
+    """Readable reference to an Atlas object for a plan"""
+    if labels and id(obj) in labels:
+        return labels[id(obj)]
+    # Association objects only have a composite key
+    return "{} {}".format(type(obj).__name__, ",".join(
+        str(x) for x in inspect(obj).identity or ()))
+
+
+def plan_value(value, labels):
+    """JSON serializable form of an attribute value"""
+    if isinstance(value, atlasdb.Base):
+        return object_label(value, labels)
+    if isinstance(value, (list, tuple)):
+        return [plan_value(x, labels) for x in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def pending_values(obj, labels):
+    """Values set on a new object, without loading anything"""
+    state = inspect(obj)
+    values = {}
+    for attr in state.mapper.attrs:
+        value = state.dict.get(attr.key)
+        if value is not None and value != []:
+            values[attr.key] = plan_value(value, labels)
+    return values
+
+
+def changed_values(obj, labels):
+    """(old, new) of every attribute changed on a persistent object"""
+    state = inspect(obj)
+    changes = {}
+    for attr in state.mapper.attrs:
+        history = state.attrs[attr.key].history
+        if not history.has_changes():
+            continue
+        if getattr(attr, "direction", MANYTOONE) is MANYTOONE:
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+        else:
+            # Collections list what was removed and added
+            old, new = list(history.deleted), list(history.added)
+        changes[attr.key] = (plan_value(old, labels), plan_value(new, labels))
+    return changes
 
 
 @contextmanager
@@ -450,21 +826,3 @@ def atlas_session_scope():
         raise
     finally:
         session.close()
-
-
-class Change(object):
-    """
-    Class for tracking changes made to the database
-    """
-    
-    def __init__(self, class_, id_, attr, old_value, new_value):
-        self.class_ = class_
-        self.db_id = id_
-        self.attribute=attr
-        self.old_value = old_value
-        self.new_value = new_value
-    
-    def to_string(self):
-        return '"{}","{}","{}","{}","{}"'.format(
-            self.class_, self.db_id, self.attribute, self.old_value,
-            self.new_value)
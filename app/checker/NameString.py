@@ -1,81 +1,136 @@
 # -*- coding: utf-8 -*-
+"""Compound name regularization
+
+Patterns are compiled once at import and results of regularize_name are
+memoized, compound names repeat a lot between datasets and checker runs.
+
+Usage:
+`from app.checker.NameString import regularize_name`
+
+`regularize_name('jacobius Methyl Ester a1')` -> 'Jacobius methyl ester A1'
+"""
 import re
+from difflib import SequenceMatcher
+from functools import lru_cache
 
 NOT_NAMED_SYNONYMS = ('unknown', 'not named', 'no name', 'unnamed', 'none',)
 SUFFIX_LIST = ('Acid', 'Ester', 'Acetate', 'Butyrate', 'Anhydride',
                'Dimer', 'Methyl', 'Ethyl', 'Aglycon', 'Aglycone')
 
+# Names at least this similar to a synonym are "Not named"
+UNNAMED_CUTOFF = 0.75
+
+SUFFIX_REGEXP = re.compile(r'\b({0})\b'.format('|'.join(SUFFIX_LIST)))
+# Suffixes anywhere in the name, longest first so Aglycone beats Aglycon
+SUFFIX_ANYWHERE_REGEXP = re.compile(
+    '|'.join(sorted(SUFFIX_LIST, key=len, reverse=True)))
+FIRST_LETTER_REGEXP = re.compile(r'^[A-Za-z]')
+LETTER_SUFFIX_REGEXP = re.compile(r'(\b[a-z]{1,2}\d?)$')
+
 
 class NameString(object):
-    
+
     def __init__(self, name):
         self.set_name(name)
-        
+
     def set_name(self, name):
         self.name = name
         self.lower_name = name.lower()
 
     def get_name(self):
         return self.name
-    
+
     def regularize_name(self):
-        self._regularize_unnamed()
-        self._regularize_capital()
-        
+        self.set_name(regularize_name(self.name))
+
     def _regularize_capital(self):
         self._decapitalize_suffixes()
         self._capitalize_first()
         self._capitalize_letter_suffixes()
-        
+
     def _regularize_unnamed(self):
-        if any(similar(self.lower_name, not_name) > 0.75 
-	       for not_name in NOT_NAMED_SYNONYMS):
+        if is_unnamed(self.lower_name):
             self.set_name('Not named')
-            
+
     def _capitalize_first(self):
-        if re.match('^[A-Za-z]', self.name):
+        if FIRST_LETTER_REGEXP.match(self.name):
             self.set_name(capitalize_first(self.name))
 
     def _capitalize_letter_suffixes(self):
-        name = self.name
-        regexp = re.compile(r'(\b[a-z]{1,2}\d?)$')
-        match = regexp.search(name)
-        if match:
-            name = regexp.sub(capitalize(match.group()), name)
-            self.set_name(name)
-            
+        self.set_name(LETTER_SUFFIX_REGEXP.sub(
+            lambda match: capitalize(match.group()), self.name))
+
     def _decapitalize_suffixes(self):
         """De-capitalize the suffixes"""
-        regexp = '\\b({0})\\b'.format('|'.join(SUFFIX_LIST))
+        self.set_name(decapitalize_suffixes(self.name))
 
-        # Store name and search for capitalized suffixes in it
-        temp_name = self.name
-        res = re.search(regexp, self.name)
 
-        while True:
-            if res:
-                res = res.group()
-            else:
-                break
-            temp_name = re.sub(res, res.lower(), temp_name)
-            res = re.search(regexp, temp_name)
+@lru_cache(maxsize=65536)
+def regularize_name(name):
+    """
+    Regularize a compound name
+    Especially important for "not named" or similar
+    """
+    name_string = NameString(name)
+    name_string._regularize_unnamed()
+    name_string._regularize_capital()
+    return name_string.get_name()
 
-        # Set name to save changes, even if none were made
-        self.set_name(temp_name)
 
+def is_unnamed(lower_name):
+    """Is a lower case name (close to) one of NOT_NAMED_SYNONYMS"""
+    if lower_name in NOT_NAMED_SYNONYMS:
+        return True
+    size = len(lower_name)
+    for not_name in NOT_NAMED_SYNONYMS:
+        # Similarity can be at most 2 * shorter / total length, most
+        # names are far longer than any synonym and never get compared
+        total = size + len(not_name)
+        if 2.0 * min(size, len(not_name)) / total <= UNNAMED_CUTOFF:
+            continue
+        matcher = SequenceMatcher(None, lower_name, not_name)
+        if (matcher.quick_ratio() > UNNAMED_CUTOFF and
+                matcher.ratio() > UNNAMED_CUTOFF):
+            return True
+    return False
 
-#### TEMPORARY FUNCTIONS TO MOVE
-from difflib import SequenceMatcher
 
+def decapitalize_suffixes(name):
+    """Lower case every capitalized suffix occurring as a word
+
+    Like the suffix words themselves, other occurrences of the same
+    suffixes in the name are lower cased too (e.g. DiMethyl Methyl ->
+    Dimethyl methyl). Lowering can expose new suffix words (e.g. the
+    Methyl of )MEthyl), so this repeats until the name stops changing
+    """
+    while True:
+        found = set(SUFFIX_REGEXP.findall(name))
+        if not found:
+            return name
+
+        def lower(match):
+            # Suffixes occurring at the same place are prefixes of each other
+            text = match.group()
+            size = max((len(x) for x in found if text.startswith(x)),
+                       default=0)
+            return text[:size].lower() + text[size:]
+
+        lowered = SUFFIX_ANYWHERE_REGEXP.sub(lower, name)
+        if lowered == name:
+            return name
+        name = lowered
+
+
+#### TEMPORARY FUNCTIONS TO MOVE
 def similar(a, b):
     """Get similarity score of two strings"""
     return SequenceMatcher(None, a, b).ratio()
-    
+
 def capitalize_first(my_string):
     return ''.join([my_string[0].upper(), my_string[1:]])
 
 def capitalize(my_string):
     return my_string.upper()
-    
+
 def decapitalize_first(my_string):
     return ''.join([my_string[0].lower(), my_string[1:]])
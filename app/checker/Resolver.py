@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""In-memory lookup of accepted journal and genus names
+
+Loads the journal, altjournal, genus and altgenus tables once into dicts
+keyed by normalised names so the Checker can resolve every article and
+compound without a query each. Names that do not resolve get ranked
+suggestions from fuzzy n-gram indexes over the same tables.
+"""
+from collections import namedtuple
+
+from .. import db
+from ..models import AltGenus, AltJournal, Genus, Journal
+from ..utils.SuggestionIndex import SuggestionIndex
+
+JournalMatch = namedtuple("JournalMatch", ["journal", "abbrev"])
+
+
+class Resolver(object):
+
+    def __init__(self):
+        self.loaded = False
+        self.journals = {}
+        self.abbrevs = {}
+        self.alt_journals = {}
+        self.genera = {}
+        self.alt_genera = {}
+        self.journal_index = SuggestionIndex()
+        self.genus_index = SuggestionIndex()
+
+    def __repr__(self):
+        return "<Resolver(journals=%d, genera=%d)>" % (
+            len(self.journals), len(self.genera))
+
+    def refresh(self):
+        """(Re)load every table, call once per checker run"""
+        self.journals, self.abbrevs, self.alt_journals = {}, {}, {}
+        self.genera, self.alt_genera = {}, {}
+        self.journal_index = SuggestionIndex()
+        self.genus_index = SuggestionIndex()
+
+        journals = {}
+        for id_, journal, abbrev in db.session.query(
+                Journal.id, Journal.journal, Journal.abbrev)\
+                .order_by(Journal.id):
+            journals[id_] = JournalMatch(journal, abbrev)
+            self.add_journal(journal, abbrev)
+        for journal_id, alt in db.session.query(
+                AltJournal.journal_id, AltJournal.altjournal)\
+                .order_by(AltJournal.id):
+            if journal_id in journals:
+                self._add(self.alt_journals, alt_journal_key(alt),
+                          journals[journal_id])
+
+        genera = {}
+        for id_, genus, genustype in db.session.query(
+                Genus.id, Genus.genus, Genus.genustype).order_by(Genus.id):
+            genera[id_] = (genus, genustype)
+            self.add_genus(genus, genustype)
+        for genus_id, alt in db.session.query(
+                AltGenus.genus_id, AltGenus.altgenus)\
+                .order_by(AltGenus.id):
+            if genus_id in genera:
+                self.add_alt_genus(alt, *genera[genus_id])
+
+        self.loaded = True
+
+    @staticmethod
+    def _add(table, key, value):
+        # Earliest entry wins, as with query(...).first()
+        if key:
+            table.setdefault(key, value)
+
+    def add_journal(self, journal, abbrev):
+        match = JournalMatch(journal, abbrev)
+        self._add(self.journals, name_key(journal), match)
+        self._add(self.abbrevs, name_key(abbrev), match)
+        self.journal_index.add(journal, journal)
+        self.journal_index.add(abbrev, journal)
+
+    def add_alt_journal(self, alt, journal):
+        """Map alt to the accepted journal with full name journal"""
+        match = self.journals.get(name_key(journal))
+        if match:
+            self._add(self.alt_journals, alt_journal_key(alt), match)
+            self.journal_index.add(alt, match.journal)
+
+    def add_genus(self, genus, genustype=None):
+        self._add(self.genera, name_key(genus), genus)
+        self.genus_index.add(genus, (genus, genustype))
+
+    def add_alt_genus(self, alt, genus, genustype=None):
+        self._add(self.alt_genera, name_key(alt), genus)
+        self.genus_index.add(alt, (genus, genustype))
+
+    def match_journal(self, journal_name):
+        """JournalMatch for a full name, abbreviation or known alternative,
+        None if unknown
+        """
+        return (self.journals.get(name_key(journal_name)) or
+                self.abbrevs.get(name_key(journal_name)) or
+                self.alt_journals.get(alt_journal_key(journal_name)))
+
+    def match_genus(self, genus_name):
+        """Accepted genus name for a genus or known alternative, None if
+        unknown
+        """
+        return (self.genera.get(name_key(genus_name)) or
+                self.alt_genera.get(name_key(genus_name)))
+
+    def suggest_journal(self, journal_name, limit=5):
+        """Accepted journals resembling journal_name, best first"""
+        return [{"value": journal} for journal in
+                self.journal_index.suggest(journal_name, limit=limit)]
+
+    def suggest_genus(self, genus_name, limit=5):
+        """Accepted genera and their types resembling genus_name,
+        best first
+        """
+        return [{"value": genus, "type": genustype} for genus, genustype in
+                self.genus_index.suggest(genus_name, limit=limit)]
+
+
+def name_key(name):
+    """Case and surrounding whitespace insensitive key"""
+    return name.strip().casefold() if name else ""
+
+
+def alt_journal_key(name):
+    # Alternative journals are stored without periods
+    return name_key(name.replace('.', '')) if name else ""
+
+
+# Shared by the checker and the views that add new names
+resolver = Resolver()
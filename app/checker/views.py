@@ -1,21 +1,25 @@
+from celery import chord
 from celery.utils.log import get_task_logger
 from flask import (abort, current_app, flash, jsonify, redirect,
                    render_template, request, url_for)
 from flask_login import login_required
-from requests.exceptions import RequestException
 
 from . import checker
 from .. import celery, db
 from ..admin.views import require_admin
 from ..models import (AltGenus, AltJournal, CheckerArticle, CheckerCompound,
-                      CheckerDataset, Dataset, Genus, Journal, Problem)
-from ..utils.pubchem_smiles_standardizer import get_standardized_smiles
+                      CheckerDataset, Compound, Dataset, Genus, Journal,
+                      Problem)
+from ..utils.PugClient import SharedRateLimiter
+from ..utils.Standardizer import get_standardizer
 from ..utils.atlasdb import atlasdb
+from ..utils.batch import chunked
 from .Checker import Checker
 from .forms import (CompoundForm, GenusForm, JournalForm, SimpleIntForm,
                     SimpleStringForm)
 from .Inserter import Inserter
 from .ResolveEnum import ResolveEnum
+from .Resolver import resolver
 
 
 logger = get_task_logger(__name__)
@@ -27,29 +31,66 @@ logger = get_task_logger(__name__)
 
 @celery.task(bind=True)
 def start_checker_task(self, dataset_id, standardize_compounds=False,
-                       restart=False):
+                       restart=False, incremental=False):
 
-    checker = Checker(dataset_id, celery_task=self, logger=logger)
-    checker.run(standardize_compounds=standardize_compounds, restart=restart)
+    checker = Checker(dataset_id, celery_task=self, logger=logger,
+                      standardizer=configured_standardizer())
+    checker.run(standardize_compounds=standardize_compounds, restart=restart,
+                incremental=incremental)
     result = "/admin/resolve/dataset{}".format(dataset_id) 
 
     return {'current': 100, 'total': 100, 'status': 'Task completed!',
             'result': result}
 
 
-@celery.task
-def standardize_dataset(ds_id):
+@celery.task(bind=True)
+def standardize_dataset(self, ds_id):
     dataset = Dataset.query.get(ds_id)
     if dataset.checker_dataset:
         dataset.checker_dataset.standardized = False
     db.session.commit()
-    run_standardization(ds_id)
+
+    # Compounds finished by an earlier, interrupted run are skipped
+    remaining = [c.id for c in dataset.get_compounds()
+                 if not c.is_standardized()]
+    if not remaining:
+        return finish_standardization(ds_id)
+
+    chunk_size = current_app.config.get("STANDARDIZE_CHUNK_SIZE", 200)
+    header = [standardize_chunk.s(chunk, ds_id, self.request.id)
+              for chunk in chunked(remaining, chunk_size)]
+    # The chord takes over this task id so its status can still be polled
+    return self.replace(chord(header, finish_standardization.si(ds_id)))
 
 
 @celery.task(bind=True)
-def insert_dataset(self, dataset_id):
-    inserter = Inserter(dataset_id, celery_task=self, logger=logger)
-    inserter.run()
+def standardize_chunk(self, compound_ids, ds_id, parent_id):
+    compounds = Compound.query.filter(Compound.id.in_(compound_ids)).all()
+    run_standardization([c for c in compounds if not c.is_standardized()])
+
+    current, total = standardization_progress(ds_id)
+    self.update_state(task_id=parent_id, state='PROGRESS',
+                      meta={'current': current, 'total': total,
+                            'status': 'Standardizing compounds...'})
+
+
+@celery.task
+def finish_standardization(ds_id):
+    dataset = Dataset.query.get(ds_id)
+    dataset.checker_dataset.standardized = True
+    commit()
+    current, total = standardization_progress(ds_id)
+
+    return {'current': current, 'total': total,
+            'status': 'Standardization completed!'}
+
+
+@celery.task(bind=True)
+def insert_dataset(self, dataset_id, digest=None):
+    inserter = Inserter(
+        dataset_id, celery_task=self, logger=logger,
+        articles_per_commit=current_app.config.get("INSERT_CHUNK_SIZE", 10))
+    inserter.run(digest=digest)
 
     result = "DATA INSERTED"
 
@@ -57,6 +98,20 @@ def insert_dataset(self, dataset_id):
             'result': result}
 
 
+@celery.task(bind=True)
+def plan_dataset_insert(self, dataset_id):
+    inserter = Inserter(dataset_id, celery_task=self, logger=logger)
+    try:
+        plan = inserter.plan()
+    except (RuntimeError, ValueError) as e:
+        # Rejected datasets and bad resolve values are reported, not raised
+        return {'current': 100, 'total': 100,
+                'status': 'Unable to plan insert', 'error': str(e)}
+
+    return {'current': 100, 'total': 100, 'status': 'Plan completed!',
+            'result': plan}
+
+
 #####################################################################
 ###                      FLASK VIEWS                              ###
 #####################################################################
@@ -65,11 +120,46 @@ def insert_dataset(self, dataset_id):
 @login_required
 @require_admin
 def start_insert_dataset(dataset_id):
-    task = insert_dataset.delay(dataset_id=dataset_id)
+    # Only insert if the Atlas still matches a reviewed plan
+    digest = request.args.get('digest')
+    task = insert_dataset.delay(dataset_id=dataset_id, digest=digest)
+
+    return jsonify({'task_id': task.id}), 202
+
+
+@checker.route('/insert/dataset<int:dataset_id>/plan', methods=['POST'])
+@login_required
+@require_admin
+def plan_insert_dataset(dataset_id):
+    """Dry run of an insert, lists what would be added and updated"""
+    task = plan_dataset_insert.delay(dataset_id=dataset_id)
 
     return jsonify({'task_id': task.id}), 202
 
 
+@checker.route('/planstatus')
+@login_required
+@require_admin
+def plan_status():
+    task_id = request.args.get('taskid')
+    task = plan_dataset_insert.AsyncResult(task_id)
+
+    if task.state == 'SUCCESS':
+        response = dict(task.info, state=task.state)
+    elif task.state == 'FAILURE':
+        response = {
+            'state': task.state,
+            'status': str(task.info)
+        }
+    else:
+        response = {
+            'state': task.state,
+            'status': 'Planning insert...'
+        }
+
+    return jsonify(response)
+
+
 @checker.route('/insertstatus')
 @login_required
 @require_admin
@@ -136,9 +226,28 @@ def startstandard(dataset_id):
 def standard_status():
     task_id = request.args.get('taskid')
     task = standardize_dataset.AsyncResult(task_id)
-    response = {
-        'state': task.state
-    }
+
+    if task.state == 'PENDING':
+        response = {
+            'state': task.state,
+            'current': 0,
+            'total': 1,
+            'status': 'Pending...'
+        }
+    elif task.state != 'FAILURE' and isinstance(task.info, dict):
+        response = {
+            'state': task.state,
+            'current': task.info.get('current', 0),
+            'total': task.info.get('total', 1),
+            'status': task.info.get('status', '')
+        }
+    else:
+        response = {
+            'state': task.state,
+            'current': 1,
+            'total': 1,
+            'status': str(task.info)
+        }
 
     return jsonify(response)
 
@@ -149,12 +258,14 @@ def standard_status():
 def startchecker(dataset_id):
     standard = bool(request.args.get("standard", False))
     restart = bool(request.args.get("restart", False))
+    incremental = bool(request.args.get("incremental", False))
 
     current_app.logger.info("Compound standardization is %s", 
                             "ON" if standard else "OFF")
     checker_task = start_checker_task.delay(dataset_id=dataset_id, 
                                             standardize_compounds=standard,
-                                            restart=restart)
+                                            restart=restart,
+                                            incremental=incremental)
     checker_dataset = CheckerDataset.query.filter_by(dataset_id=dataset_id).first()
 
     if not checker_dataset:
@@ -525,12 +636,16 @@ def save_journal(form, article):
         alt = AltJournal(altjournal=form.value.data.lower().replace(".",""),
                          journal=journal)
         db_add_commit(alt)
+        if resolver.loaded:
+            resolver.add_alt_journal(alt.altjournal, journal.journal)
 
     elif option == "new":
         article.journal = form.new_journal_full.data
         new = Journal(journal=form.new_journal_full.data,
                       abbrev=form.new_journal_abbrev.data)
         db_add_commit(new)
+        if resolver.loaded:
+            resolver.add_journal(new.journal, new.abbrev)
 
     else:
         abort(500)
@@ -553,12 +668,16 @@ def save_genus(form, compound):
         alt = AltGenus(altgenus=original.lower(),
                        genustype=type_,genus=genus)
         db_add_commit(alt)
+        if resolver.loaded:
+            resolver.add_alt_genus(alt.altgenus, genus.genus, genus.genustype)
 
     elif option == "new":
         genus_string = form.new_genus_name.data
         compound.source_genus = genus_string
         new = Genus(genus=genus_string, genustype=type_)
         db_add_commit(new)
+        if resolver.loaded:
+            resolver.add_genus(new.genus, new.genustype)
 
     else:
         abort(500)
@@ -585,22 +704,47 @@ def save_compound(form, article, compound):
 
     commit()    
 
-def run_standardization(dataset_id):
-    dataset = Dataset.query.get_or_404(dataset_id)
-    for compound in dataset.get_compounds():
-        smiles = compound.smiles
-        try:
-            compound.smiles = get_standardized_smiles(smiles)
-            db.session.commit()
-        except (ValueError, TypeError, RequestException):
-            print("Error standardizing SMILES %s", smiles)
-            db.session.rollback()
-    dataset.checker_dataset.standardized = True
-    try:
-        commit()
-    except:
-        flash("Could not reach database!")
-        abort(500)
+def run_standardization(compounds):
+    """Standardize compounds and record which ones completed"""
+    standardizer = configured_standardizer()
+    standardized = standardizer.standardize_many(
+        [c.smiles for c in compounds])
+    for compound in compounds:
+        smiles = standardized.get(compound.smiles)
+        if smiles:
+            compound.smiles = smiles
+            compound.standardized_smiles = smiles
+        else:
+            logger.error("Error standardizing SMILES %s", compound.smiles)
+    commit()
+
+
+def configured_standardizer():
+    """Standardization backend of the app config, its PubChem requests
+    keep to the rate limit shared by every task
+    """
+    return get_standardizer(
+        current_app.config.get("STANDARDIZATION_BACKEND"),
+        concurrency=current_app.config.get("PUBCHEM_CONCURRENCY", 8),
+        rate=current_app.config.get("PUBCHEM_RATE_LIMIT", 5),
+        limiter=pubchem_rate_limiter())
+
+
+def pubchem_rate_limiter():
+    """PubChem request budget shared by the standardization chunks running
+    in parallel, None limits each chunk separately
+    """
+    url = current_app.config.get("PUBCHEM_RATE_LIMIT_REDIS")
+    if not url:
+        return None
+    return SharedRateLimiter.from_url(
+        url, current_app.config.get("PUBCHEM_RATE_LIMIT", 5))
+
+
+def standardization_progress(dataset_id):
+    compounds = Dataset.query.get(dataset_id).get_compounds()
+    done = sum(1 for c in compounds if c.is_standardized())
+    return done, len(compounds)
 
 
 def db_add_commit(db_object):
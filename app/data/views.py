@@ -355,6 +355,9 @@ def delete_compound():
     # Compound index in article
     idx = article.compounds.index(compound)
     article.compounds.pop(idx)
+    # Removing a compound leaves the article columns unchanged, mark the
+    # edit so an incremental check does not carry over its old problems
+    article.last_edit_date = db.func.current_timestamp()
     try_dbcommit()
 
     # Store session cookie as compound before deleted
@@ -416,6 +419,8 @@ def save_data_to_article(article, data):
         db_cmpd.curated_compounds = cmpd['curated_compound']
 
         actual_cmpds.append(db_cmpd)
+    if actual_cmpds != list(article.compounds):
+        article.last_edit_date = db.func.current_timestamp()
     article.compounds = actual_cmpds
 
     return article
@@ -1,3 +1,5 @@
+import json
+
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 
@@ -159,9 +161,19 @@ class Article(db.Model):
     needs_work = db.Column(db.Boolean, default=False)
     is_nparticle = db.Column(db.Boolean, default=True)
     npa_artid = db.Column(db.Integer)
+    # Committed to the Atlas, re-checks and resumed inserts skip the article
+    inserted = db.Column(db.Boolean, default=False)
+    last_edit_date = db.Column(db.DateTime, default=db.func.current_timestamp(),
+                               onupdate=db.func.current_timestamp())
     checker_article = db.relationship('CheckerArticle', uselist=False,
                                       backref='article')
 
+    def edited_since(self, timestamp):
+        """
+        True if the article itself was edited after timestamp
+        """
+        return bool(self.last_edit_date and self.last_edit_date > timestamp)
+
 
 class Compound(db.Model):
     """
@@ -173,9 +185,20 @@ class Compound(db.Model):
     smiles = db.Column(db.String(1000))
     source_organism = db.Column(db.String(255))
     npaid = db.Column(db.Integer)
+    last_edit_date = db.Column(db.DateTime, default=db.func.current_timestamp(),
+                               onupdate=db.func.current_timestamp())
+    # SMILES as left by the last successful standardization
+    standardized_smiles = db.Column(db.String(1000))
     checker_compound = db.relationship('CheckerCompound', uselist=False,
                                        backref='compound')
 
+    def is_standardized(self):
+        """
+        True if standardized and not edited since
+        """
+        return bool(self.standardized_smiles and
+                    self.standardized_smiles == self.smiles)
+
 
 # ================================================================
 # =====                Checker Database Models               =====
@@ -193,6 +216,8 @@ class CheckerDataset(db.Model):
     running = db.Column(db.Boolean, default=False)
     completed = db.Column(db.Boolean, default=False)
     inserted = db.Column(db.Boolean, default=False)
+    # Start time of the last completed checker run
+    last_check_date = db.Column(db.DateTime)
 
 
 class CheckerArticle(db.Model):
@@ -235,6 +260,8 @@ class CheckerCompound(db.Model):
     pubchem_id = db.Column(db.Integer)
     berdy_id = db.Column(db.Integer)
     resolve = db.Column(db.Integer)
+    # Hash of the curated smiles, name and organism this was built from
+    source_hash = db.Column(db.String(40))
 
     def get_article_id(self):
         article = self.compound.article[0]
@@ -363,6 +390,8 @@ class Problem(db.Model):
         One of the types of issues
     resolved: bool
         Has a problem been handled
+    suggestions : str
+        JSON list of ranked corrections found by the checker
     """
 
     __tablename__ = "problem"
@@ -372,6 +401,11 @@ class Problem(db.Model):
     compound_id = db.Column(db.Integer, db.ForeignKey('compound.id'))
     problem = db.Column(db.String(255), nullable=False)
     resolved = db.Column(db.Boolean, default=False)
+    suggestions = db.Column(db.Text)
+
+    def get_suggestions(self):
+        """Suggested corrections as a list of dicts, best first"""
+        return json.loads(self.suggestions) if self.suggestions else []
 
 
 # Famous retractions
@@ -53,6 +53,10 @@ async function monitorStandardization(datasetId, taskId) {
         alert("Failed to standardize dataset!");
         $(`#dataset-checker-button-${datasetId}`).removeAttr("disabled").html("Run Standardization");
     } else {
+        if (result.state === "PROGRESS") {
+            $(`#dataset-checker-button-${datasetId}`)
+                .html(`Standardization Running (${result.current}/${result.total})`);
+        }
         await timeout(3000);
         monitorStandardization(datasetId, taskId);
     }
@@ -26,7 +26,7 @@ async function monitorInsertion(datasetId, taskId) {
     if (result.state === "SUCCESS") {
         insertionComplete(datasetId);
     } else if (result.state === "FAILURE") {
-        alert('Failed to insert dataset!');
+        alert('Failed to insert dataset: ' + result.status);
         $(`#dataset-insert-button`).removeAttr("disabled");
     } else {
         await timeout(3000);
@@ -35,11 +35,58 @@ async function monitorInsertion(datasetId, taskId) {
 }
 
 
-function startInserter(datasetId) {
-    $.post('/insert/dataset'+datasetId, {})
+function startInserter(datasetId, digest) {
+    const query = digest ? `?digest=${digest}` : '';
+    $.post('/insert/dataset'+datasetId+query, {})
         .done( (retJson) => {
             monitorInsertion(datasetId, retJson.task_id);
         }).fail( () => {
             alert('Failed to insert Dataset '+ datasetId);
         });
 }
+
+
+function confirmPlan(datasetId, plan) {
+    const lines = plan.inserts.map(x => x.object)
+        .concat(plan.updates.map(x =>
+            `${x.object}.${x.attribute}: ${x.old_value} -> ${x.new_value}`));
+    const summary = `${plan.inserts.length} inserts and ` +
+        `${plan.updates.length} updates\n\n` +
+        lines.slice(0, 30).join('\n') +
+        (lines.length > 30 ? '\n...' : '');
+    if (confirm(summary + '\n\nInsert Dataset ' + datasetId + '?')) {
+        startInserter(datasetId, plan.digest);
+    }
+}
+
+
+async function monitorPlan(datasetId, taskId) {
+    const statusUrl = `/planstatus?taskid=${taskId}`;
+    try {
+        result = await $.getJSON(statusUrl);
+    } catch(err) {
+        throw "Error, could not plan insert of Dataset "+datasetId;
+    }
+
+    if (result.state === "SUCCESS" && result.error) {
+        alert('Failed to plan insert: ' + result.error);
+    } else if (result.state === "SUCCESS") {
+        confirmPlan(datasetId, result.result);
+    } else if (result.state === "FAILURE") {
+        alert('Failed to plan insert: ' + result.status);
+    } else {
+        await timeout(3000);
+        monitorPlan(datasetId, taskId);
+    }
+}
+
+
+// Dry run the insert and only insert what was reviewed
+function previewInserter(datasetId) {
+    $.post(`/insert/dataset${datasetId}/plan`, {})
+        .done( (retJson) => {
+            monitorPlan(datasetId, retJson.task_id);
+        }).fail( () => {
+            alert('Failed to plan insert of Dataset ' + datasetId);
+        });
+}
@@ -45,6 +45,19 @@ $(() => {
     });
 });
 
+// Suggested corrections fill the alternative name form
+$(() => {
+    $(".suggestion").click(function () {
+        $($(this).data("select")).val("alt");
+        showJournal();
+        showGenus();
+        if ($(this).data("type")) {
+            $("#genus_type").val($(this).data("type"));
+        }
+        $($(this).data("target")).val($(this).data("value"));
+    });
+});
+
 
 function showNPAID() {
     selected = $("#compoundSelect").children("option:selected").val();
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of NP Atlas compound InChIKeys and names
+
+Loading (compound_id, inchikey) pairs up front, either for the whole
+Atlas or in a few chunked IN queries for a dataset, is far cheaper than
+issuing one LIKE query per checked compound against the Atlas server.
+"""
+from sqlalchemy import or_
+
+from .batch import chunked
+
+# Keep IN (...) lists well under the MySQL max_allowed_packet
+QUERY_CHUNK_SIZE = 500
+
+
+class AtlasIndex(object):
+
+    def __init__(self, atlasdb):
+        """Initialize an empty index
+
+            :atlasdb (AtlasDB) - Atlas access layer used to load compounds
+        """
+        self.atlasdb = atlasdb
+        self.loaded = False
+        self._reset()
+
+    def __len__(self):
+        return len(self._inchikeys)
+
+    def __repr__(self):
+        return "<AtlasIndex(compounds=%d, loaded=%s)>" % (
+            len(self), self.loaded)
+
+    def _reset(self):
+        # InChIKey of each compound id, the sets share its strings
+        self._inchikeys = {}
+        self._keys = set()
+        self._blocks = set()
+        self._names = set()
+
+    def refresh(self, chunk_size=5000):
+        """Reload every compound in the NP Atlas into the index
+
+            :chunk_size (int) - Number of rows to stream from the DB at once
+        """
+        sess = self.atlasdb.startSession()
+        try:
+            rows = sess.query(self.atlasdb.Compound.id,
+                              self.atlasdb.Compound.inchikey)\
+                .yield_per(chunk_size)
+            self._reset()
+            for compound_id, inchikey in rows:
+                self.add(compound_id, inchikey)
+        finally:
+            sess.close()
+        self.loaded = True
+
+    def load(self, inchikeys=(), compound_ids=(), chunk_size=QUERY_CHUNK_SIZE):
+        """Load only the Atlas compounds relevant to a set of structures
+
+            :inchikeys (iterable) - InChIKeys to find flat and full matches for
+            :compound_ids (iterable) - Atlas compound ids (NPAIDs) to load
+            :chunk_size (int) - Maximum number of values per query
+        """
+        Compound = self.atlasdb.Compound
+        blocks = sorted({first_block(x) for x in inchikeys if x})
+        compound_ids = sorted({x for x in compound_ids if x})
+        sess = self.atlasdb.startSession()
+        try:
+            for chunk in chunked(blocks, chunk_size):
+                rows = sess.query(Compound.id, Compound.inchikey)\
+                    .filter(or_(*[Compound.inchikey.startswith(x)
+                                  for x in chunk]))
+                for compound_id, inchikey in rows:
+                    self.add(compound_id, inchikey)
+            for chunk in chunked(compound_ids, chunk_size):
+                rows = sess.query(Compound.id, Compound.inchikey)\
+                    .filter(Compound.id.in_(chunk))
+                for compound_id, inchikey in rows:
+                    self.add(compound_id, inchikey)
+        finally:
+            sess.close()
+
+    def load_names(self, names, chunk_size=QUERY_CHUNK_SIZE):
+        """Load which of the given compound names exist in the Atlas"""
+        Name = self.atlasdb.Name
+        names = sorted({x for x in names if x})
+        sess = self.atlasdb.startSession()
+        try:
+            for chunk in chunked(names, chunk_size):
+                rows = sess.query(Name.name).filter(Name.name.in_(chunk))
+                self._names.update(normalize_name(x) for x, in rows)
+        finally:
+            sess.close()
+
+    def add(self, compound_id, inchikey):
+        """Add a single compound to the index"""
+        if not inchikey or compound_id in self._inchikeys:
+            return
+        self._inchikeys[compound_id] = inchikey
+        self._keys.add(inchikey)
+        self._blocks.add(first_block(inchikey))
+
+    def has_block(self, inchikey):
+        """True if any Atlas compound shares the connectivity block"""
+        return first_block(inchikey) in self._blocks
+
+    def has_inchikey(self, inchikey):
+        """True if an Atlas compound has exactly this InChIKey"""
+        return inchikey in self._keys
+
+    def has_name(self, name):
+        """True if a loaded Atlas compound name matches this name"""
+        return bool(name) and normalize_name(name) in self._names
+
+    def get_inchikey(self, compound_id):
+        """Return the InChIKey for an Atlas compound id or None"""
+        return self._inchikeys.get(compound_id)
+
+
+def first_block(inchikey):
+    """Get the connectivity (first) block of an InChIKey"""
+    return inchikey.split('-')[0]
+
+
+def normalize_name(name):
+    """Approximate the case insensitive MySQL collation for names"""
+    return name.rstrip().lower()
@@ -3,16 +3,35 @@
 """
 import copy
 import logging
+import os
+from billiard import Pool
+from billiard.exceptions import WorkerLostError
 from rdkit import Chem
-from rdkit.Chem import rdMolDescriptors, rdDepictor, Descriptors, SaltRemover
-from rdkit.Chem.AllChem import ReplaceSubstructs
+from rdkit.Chem import rdMolDescriptors, rdDepictor, Descriptors
 # Silence RDKit Warning
 from rdkit import rdBase
 rdBase.DisableLog('rdApp.warning')
 from requests.exceptions import RequestException
 
-from .timeout import exit_after
-from .pubchem_smiles_standardizer import get_standardized_smiles
+from .DiskCache import CACHE_PATH, DiskCache
+from .adducts import adduct_mz
+from .batch import chunked
+from .timeout import DeadlineExceeded, with_deadline
+from .Standardizer import get_standardizer
+from .StructureCleaner import structure_cleaner
+from .StructureRecord import StructureRecord
+
+# Shared cache of RDKit derived properties keyed by canonical SMILES
+molprop_cache = DiskCache(
+    CACHE_PATH,
+    namespace="molprops",
+    max_entries=int(os.environ.get("MOLPROP_CACHE_SIZE", 200000))
+)
+
+def _molprop(name):
+    return property(lambda self: self._getMolprop(name),
+                    doc="%s computed on first access" % name)
+
 
 class Compound(object):
 
@@ -25,15 +44,23 @@ class Compound(object):
             :name (str) - Default = "Unknown" - Name of compound, also sets
                           name in Molblock
             :standardize (bool) - Default = False - Control whether SMILES is
-                                  subject to PubChem Standardization attempt
+                                  subject to a standardization attempt with
+                                  the configured backend
+            :standardizer (Standardizer) - Default = None - Backend to
+                                           standardize with, None uses
+                                           get_standardizer()
+            :cache (DiskCache) - Default = molprop_cache - Cache of computed
+                                 properties, None disables caching
         """
+        self.cache = kwargs.get("cache", molprop_cache)
 
         # Standardize as a kwarg to allow disabling PubChem Standardization
         # explicitly
-        standardize = kwargs.get("standardize", False)
-        if standardize:
-            # Try to standardize the smiles, will time out after 5 seconds
-            # and resort to supplied smiles string
+        self.standardize = kwargs.get("standardize", False)
+        self.standardizer = kwargs.get("standardizer", None)
+        if self.standardize:
+            # Try to standardize the smiles, gives up after 5 seconds
+            # and resorts to supplied smiles string
             self._standardizeSmiles(smiles=smiles)
         else:
             self.smiles = smiles
@@ -42,15 +69,17 @@ class Compound(object):
         # This property
         self.name = kwargs.get("name", "Unknown")
 
-        # rdmol
+        # rdmol, derived properties are computed from it on first use
+        self._props = None
+        self._cache_key = None
+        self._unsaved = False
+        self._rdmol = None
         try:
             self.rdmol = Chem.MolFromSmiles(self.smiles)
         except TypeError as e:
             logging.error("RDKit was unable to load this compound")
             logging.error(e)
 
-        self.calcMolprops()
-
 
     def __repr__(self):
         """repr for debugging
@@ -61,150 +90,236 @@ class Compound(object):
     def copy(self):
         return copy.deepcopy(self)
 
+    def to_record(self):
+        """StructureRecord of every property, without the RDKit molecule"""
+        self.calcMolprops()
+        return StructureRecord.from_compound(self)
+
+    @property
+    def rdmol(self):
+        return self._rdmol
+
+    @rdmol.setter
+    def rdmol(self, mol):
+        # Every derived property depends on the molecule
+        self._rdmol = mol
+        self._props = None
+        self._cache_key = None
+        self._unsaved = False
+
+    inchi = _molprop("inchi")
+    inchikey = _molprop("inchikey")
+    accurate_mass = _molprop("accurate_mass")
+    mass = _molprop("mass")
+    m_plus_h = _molprop("m_plus_h")
+    m_plus_na = _molprop("m_plus_na")
+    formula = _molprop("formula")
+
+    @property
+    def molblock(self):
+        # Set name in molblock
+        molblock = self._getMolprop("molblock")
+        return "\n".join([self.name, molblock.split("\n", 1)[1]])
+
     def calcMolprops(self):
-        """Calculate masses for mol using RDKit
+        """Calculate every molecular property now rather than on first use
 
         Masses calculated and rounded to 4 decimal points
-        [M+H]+ and other adducts can be calculated using RDKit
-        and the calculate_exact_mass function by providing an
-        appropriate SMILES string
+        [M+H]+ and other adducts can be calculated with the
+        adduct_mz and adduct_table functions in app.utils.adducts
         """
-        self.inchi = Chem.MolToInchi(self.rdmol)
-        self.inchikey = Chem.MolToInchiKey(self.rdmol)
-        self.accurate_mass = round(Descriptors.ExactMolWt(self.rdmol), 4)
-        self.mass = round(Descriptors.MolWt(self.rdmol), 4)
-        self.m_plus_h = round(self.accurate_mass + calculate_exact_mass('[H+]'), 4)
-        self.m_plus_na = round(self.accurate_mass + calculate_exact_mass('[Na+]'), 4)
-        # Set name in molblock
-        self.rdmol.SetProp('_Name', self.name)
-        rdDepictor.Compute2DCoords(self.rdmol)
-        self.molblock = Chem.MolToMolBlock(self.rdmol)
-        self.formula = rdMolDescriptors.CalcMolFormula(self.rdmol)
+        for name in MOLPROPS:
+            self._getMolprop(name)
+        self.saveMolprops()
+
+    def saveMolprops(self):
+        """Write properties computed since the last save to the property
+        cache, all in one entry
+        """
+        if self._unsaved and self.cache is not None:
+            self.cache.set(self._cache_key, self._props)
+        self._unsaved = False
+
+    def _getMolprop(self, name):
+        """Memoized molecular property, shared through the property cache
+        once saved
+        """
+        if self._props is None:
+            self._props = {}
+            if self.cache is not None:
+                self._cache_key = DiskCache.make_key(
+                    rdBase.rdkitVersion, Chem.MolToSmiles(self.rdmol))
+                self._props.update(self.cache.get(self._cache_key, {}))
+        if name not in self._props:
+            self._props[name] = MOLPROPS[name](self)
+            self._unsaved = True
+        return self._props[name]
 
     def cleanStructure(self):
         """Clean molecular structure using RDKit
 
-        First: Strip salts
-        Second: Second, check for fragments
+        First: Strip salts and neutralize charges
+        Second: Keep only the largest fragment
+
+        When only charges changed the properties are recomputed on next
+        use without standardizing again
         """
-        Chem.rdmolops.Cleanup(self.rdmol)
-        neutralized = self._neutralizeMol()
-        defragmented = self._getLargestFragment()
-        if neutralized or defragmented:
-            logging.warning('WARNING: Compound structure changed')
+        # Clean a copy, replacing the molecule resets its derived properties
+        cleaned = Chem.Mol(self.rdmol)
+        Chem.rdmolops.Cleanup(cleaned)
+        self.rdmol = cleaned
+        mol, neutralized, defragmented = structure_cleaner.clean(cleaned)
+        if not (neutralized or defragmented):
+            return
+        logging.warning('WARNING: Compound structure changed')
+        if defragmented:
+            logging.info('Found salts or fragments in molecule: %s\t%s',
+                         self.name, self.smiles)
+        self.rdmol = mol
+        self.smiles = Chem.MolToSmiles(mol)
+        if defragmented and self.standardize:
             self._standardizeSmiles()
-            self.calcMolprops()
-
-    def _neutralizeMol(self):
-        """Strip salts and neutralize molecule"""
-        neutralized = False
-        _remover = SaltRemover.SaltRemover()
-        molnosalt, deleted = _remover.StripMolWithDeleted(self.rdmol)
-        if deleted:
-            logging.info('Found salt in molecule: %s\t%s'
-                     % (self.name, self.inchikey))
-            neutralized_mol, neutralized = _neutraliseCharges(
-                Chem.MolToSmiles(molnosalt))
-        else:
-            neutralized_mol, neutralized = _neutraliseCharges(
-                self.smiles)
-        neutral_mol = Chem.MolFromSmiles(neutralized_mol)
-        if neutralized:
-            logging.debug('Molecule was neutralized')
-            self.rdmol = neutral_mol
-            self.smiles = neutralized_mol
-        return neutralized
-
-    def _getLargestFragment(self):
-        """Check if molecule is fragmented. If so, strip to largest fragment"""
-        is_fragments = False
-        fragments = Chem.GetMolFrags(self.rdmol, asMols=True)
-        if len(fragments) > 1:
-            is_fragments = True
-            logging.info('Found multiple fragments in molecule: %s\t%s'
-                     % (self.name, self.inchikey))
-            for frag in fragments:
-                longest = 0
-                n_atoms = frag.GetNumAtoms()
-                if n_atoms > longest and n_atoms > 0:
-                    longest = n_atoms
-                    self.rdmol = frag
-        return is_fragments
+            standardized = Chem.MolFromSmiles(self.smiles)
+            if standardized is not None:
+                self.rdmol = standardized
 
     def _standardizeSmiles(self, smiles=None):
-        """Use PubChem webservices to standardize smiles
+        """Use the configured backend to standardize smiles
         If the service timesout, or fails for some other reason
         SMILES remains the same
         """
         if not smiles:
             smiles = self.smiles
         try:
-            self.smiles = standardize_smiles_wrapper(smiles)
-        except (KeyboardInterrupt, TypeError, ValueError,
+            self.smiles = standardize_smiles_wrapper(smiles,
+                                                     self.standardizer)
+        except (DeadlineExceeded, TypeError, ValueError,
                 RequestException) as e:
             logging.error("Unable to standardize %s", smiles)
             logging.error(e)
             self.smiles = smiles
 
 
-# Helper functions
-# Below two functions are taken directly from
-# http://www.rdkit.org/docs/Cookbook.html
-def _InitialiseNeutralisationReactions():
-    patts = (
-        # Imidazoles
-        ('[n+;H]', 'n'),
-        # Amines
-        ('[N+;!H0]', 'N'),
-        # Carboxylic acids and alcohols
-        ('[$([O-]);!$([O-][#7])]', 'O'),
-        # Thiols
-        ('[S-;X1]', 'S'),
-        # Sulfonamides
-        ('[$([N-;X2]S(=O)=O)]', 'N'),
-        # Enamines
-        ('[$([N-;X2][C,N]=C)]', 'N'),
-        # Tetrazoles
-        ('[n-]', '[nH]'),
-        # Sulfoxides
-        ('[$([S-]=O)]', 'S'),
-        # Amides
-        ('[$([N-]C=O)]', 'N'),
-    )
-    return [(Chem.MolFromSmarts(x),
-             Chem.MolFromSmiles(y, False)) for x, y in patts]
-
-
-_reactions = None
-
-
-def _neutraliseCharges(smiles, reactions=None):
-    global _reactions
-    if reactions is None:
-        if _reactions is None:
-            _reactions = _InitialiseNeutralisationReactions()
-        reactions = _reactions
-    mol = Chem.MolFromSmiles(smiles)
-    replaced = False
-    for i, (reactant, product) in enumerate(reactions):
-        while mol.HasSubstructMatch(reactant):
-            replaced = True
-            rms = ReplaceSubstructs(mol, reactant, product)
-            mol = rms[0]
-    if replaced:
-        return (Chem.MolToSmiles(mol, True), True)
-    else:
-        return (smiles, False)
+# Name independent molecular properties computed from Compound.rdmol
+def _molblock(compound):
+    # Lay out a copy so the molecule itself is left untouched
+    mol = Chem.Mol(compound.rdmol)
+    rdDepictor.Compute2DCoords(mol)
+    return Chem.MolToMolBlock(mol)
+
+
+MOLPROPS = {
+    "inchi": lambda c: Chem.MolToInchi(c.rdmol),
+    "inchikey": lambda c: Chem.MolToInchiKey(c.rdmol),
+    "accurate_mass": lambda c: round(Descriptors.ExactMolWt(c.rdmol), 4),
+    "mass": lambda c: round(Descriptors.MolWt(c.rdmol), 4),
+    "m_plus_h": lambda c: adduct_mz(c.accurate_mass, "[M+H]+"),
+    "m_plus_na": lambda c: adduct_mz(c.accurate_mass, "[M+Na]+"),
+    "formula": lambda c: rdMolDescriptors.CalcMolFormula(c.rdmol),
+    "molblock": _molblock
+}
 
 
+# Helper functions
 def calculate_exact_mass(smiles):
     m = Chem.MolFromSmiles(smiles)
     return Descriptors.ExactMolWt(m)
 
-@exit_after(5)
-def standardize_smiles_wrapper(smiles):
-    return get_standardized_smiles(smiles)
+@with_deadline(5)
+def standardize_smiles_wrapper(smiles, standardizer=None):
+    return (standardizer or get_standardizer()).standardize(smiles)
 
 def inchikey_from_smiles(smiles):
     m = Chem.MolFromSmiles(smiles)
     return Chem.MolToInchiKey(m)
+
+
+def structure_record(smiles, name="Unknown", standardize=False,
+                     standardizer=None):
+    """Compute all structure derived fields for a SMILES string
+
+    Returns a StructureRecord so results can be passed between processes
+    """
+    compound = Compound(smiles, name=name, standardize=standardize,
+                        standardizer=standardizer)
+    compound.cleanStructure()
+    return compound.to_record()
+
+
+def _structure_record_chunk(jobs):
+    return [structure_record(*job) for job in jobs]
+
+
+def structure_records(jobs, processes=None, standardizer=None):
+    """Compute structure records for many compounds across a process pool
+
+        :jobs (list) - (smiles, name, standardize) tuples
+        :processes (int) - Default = None - Number of worker processes,
+                           None uses every core and 1 runs serially
+        :standardizer (Standardizer) - Default = None - Backend for the
+                                       jobs to standardize, None uses
+                                       get_standardizer()
+
+    Structures are standardized here in batches rather than one by one in
+    the workers, so PubChem requests keep to the standardizer's rate limit
+    whatever the number of workers
+
+    Returns records in the same order as jobs
+    """
+    jobs = list(jobs)
+    todo = [smiles for smiles, _, standardize in jobs if standardize]
+    if not todo:
+        return _pooled_records(jobs, processes)
+
+    standardizer = standardizer or get_standardizer()
+    standardized = standardizer.standardize_many(todo)
+    jobs = [(standardized.get(smiles) or smiles if standardize else smiles,
+             name, standardize) for smiles, name, standardize in jobs]
+    records = _pooled_records([(smiles, name) for smiles, name, _ in jobs],
+                              processes)
+
+    # As in Compound.cleanStructure, standardize again the structures
+    # which lost fragments
+    defragmented = [i for i, (smiles, _, standardize) in enumerate(jobs)
+                    if standardize and "." in smiles]
+    if defragmented:
+        again = standardizer.standardize_many(
+            [records[i].smiles for i in defragmented])
+        for i in defragmented:
+            smiles = again.get(records[i].smiles)
+            if smiles and Chem.MolFromSmiles(smiles) is not None:
+                records[i] = Compound(smiles,
+                                      name=records[i].name).to_record()
+    return records
+
+
+def _pooled_records(jobs, processes):
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(jobs) < 2:
+        return _structure_record_chunk(jobs)
+    chunksize = max(1, len(jobs) // (4 * processes))
+    try:
+        # billiard, Celery's fork of multiprocessing, also starts pools
+        # from the daemonic Celery prefork workers
+        pool = Pool(processes)
+    except OSError as e:
+        logging.warning("Unable to start process pool, running serially")
+        logging.warning(e)
+        return _structure_record_chunk(jobs)
+    try:
+        # A task per chunk rather than pool.map, which credits every
+        # chunk to one worker and stalls the others on shutdown
+        results = [pool.apply_async(_structure_record_chunk, (chunk,))
+                   for chunk in chunked(jobs, chunksize)]
+        records = [record for result in results for record in result.get()]
+    except Exception as e:
+        pool.terminate()
+        # billiard wraps errors from the workers with their traceback
+        if not isinstance(getattr(e, "exc", e), WorkerLostError):
+            raise
+        logging.warning("Process pool worker died, running serially")
+        logging.warning(e)
+        return _structure_record_chunk(jobs)
+    pool.close()
+    pool.join()
+    return records
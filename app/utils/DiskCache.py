@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Persistent key-value cache backed by SQLite
+
+Values are stored as JSON and evicted in least recently used order once
+the cache grows past its size limit. Entries may be given a time to live
+after which they are treated as missing. Safe to share between processes.
+A cache which can not be opened or written behaves as if always empty.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+# cache/ of the project rather than of the working directory
+CACHE_DIR = os.environ.get("CURATOR_CACHE_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__)))), "cache"))
+CACHE_PATH = os.path.join(CACHE_DIR, "curator_cache.sqlite")
+
+# Access times of read entries written together
+TOUCH_BATCH = 100
+
+class DiskCache(object):
+
+    def __init__(self, path, namespace="default", max_entries=100000,
+                 ttl=None):
+        """Initialize DiskCache object
+
+            :path (str) - SQLite file to store the cache in
+            :namespace (str) - Default = "default" - Keeps unrelated caches
+                               in the same file apart
+            :max_entries (int) - Default = 100000 - Entries kept in this
+                                 namespace before LRU eviction
+            :ttl (float) - Default = None - Seconds entries stay valid,
+                           None keeps them until evicted
+        """
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = None
+        self._pid = None
+        self._count = None
+        self._touched = {}
+
+    def __repr__(self):
+        return "<DiskCache(path='%s', namespace='%s')>" % (
+            self.path, self.namespace)
+
+    def __deepcopy__(self, memo):
+        # Copies of objects holding a cache share the same store
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_conn=None, _pid=None, _count=None, _touched={})
+        return state
+
+    @staticmethod
+    def make_key(*parts):
+        """Content address for a set of strings"""
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    @property
+    def conn(self):
+        # Connections can not be shared across forked processes
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.realpath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, accessed REAL NOT NULL, "
+                "expires REAL, PRIMARY KEY (namespace, key))")
+            columns = [row[1] for row in
+                       self._conn.execute("PRAGMA table_info(cache)")]
+            if "expires" not in columns:
+                # Cache files written before entries could expire
+                self._conn.execute("ALTER TABLE cache ADD COLUMN expires REAL")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed "
+                "ON cache (namespace, accessed)")
+            self._pid = os.getpid()
+            self._count = None
+        return self._conn
+
+    def get(self, key, default=None):
+        """Return the cached value for key or default"""
+        try:
+            row = self.conn.execute(
+                "SELECT value, expires FROM cache "
+                "WHERE namespace = ? AND key = ?",
+                (self.namespace, key)).fetchone()
+            if row is None:
+                return default
+            if row[1] is not None and row[1] < time.time():
+                self.conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key))
+                self._count = None
+                return default
+            # Eviction only needs a rough least recently used order
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._write_touched()
+            return json.loads(row[0])
+        except (sqlite3.Error, OSError) as e:
+            logging.warning("Unable to read from cache %s", self.path)
+            logging.warning(e)
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a JSON serializable value under key
+
+            :ttl (float) - Default = None - Overrides the cache's time to
+                           live for this entry
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        self._touched.pop(key, None)
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache "
+                "(namespace, key, value, accessed, expires)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now,
+                 None if ttl is None else now + ttl))
+            self._evict()
+        except (sqlite3.Error, OSError) as e:
+            logging.warning("Unable to write to cache %s", self.path)
+            logging.warning(e)
+
+    def clear(self):
+        """Remove every entry in this namespace"""
+        self.conn.execute("DELETE FROM cache WHERE namespace = ?",
+                          (self.namespace,))
+        self._count = 0
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?",
+            (self.namespace,)).fetchone()[0]
+
+    def _write_touched(self):
+        """Store the access times of entries read since the last write"""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        # One transaction for the batch rather than one per entry
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                [(accessed, self.namespace, key)
+                 for key, accessed in touched.items()])
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _evict(self):
+        """Drop least recently used entries once over the size limit"""
+        if self._count is None:
+            self._count = len(self)
+        else:
+            self._count += 1
+        # Allow 10% slack so eviction runs in batches rather than per insert
+        if self._count <= self.max_entries * 1.1:
+            return
+        self._write_touched()
+        self.conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache WHERE namespace = ? "
+            "ORDER BY accessed ASC LIMIT ?)",
+            (self.namespace, self.namespace,
+             max(0, len(self) - self.max_entries)))
+        self._count = len(self)
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous client for the PubChem PUG standardization service
+
+Submits many standardization jobs over one pooled HTTP session and polls
+the outstanding request ids concurrently. Concurrency and the request
+rate are bounded so large datasets stay within PubChem's usage policy.
+
+Usage:
+`from app.utils.PugClient import standardize_smiles_batch`
+
+`standardize_smiles_batch(["CCO", "C(=O)O"])` returns a dict mapping each
+input SMILES to its standardized SMILES, or None if it could not be
+standardized.
+
+Parallel tasks can share one request budget through a SharedRateLimiter
+kept in Redis.
+
+Results are remembered in a persistent cache, failures for a shorter time
+than successes, so re-standardizing a dataset rarely reaches PubChem.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+import redis
+
+from .DiskCache import CACHE_PATH, DiskCache
+from .timeout import DeadlineExceeded, request_timeout
+from .pubchem_smiles_standardizer import (get_PCT_reqid, get_PCT_smiles,
+                                          get_PCT_status, is_smiles,
+                                          pubchem_poll_string,
+                                          pubchem_smile_standarize_string,
+                                          urlSend)
+
+# PubChem asks for no more than 5 requests per second
+DEFAULT_RATE = 5
+DEFAULT_CONCURRENCY = 8
+
+# Statuses returned while a job is still being processed
+PENDING_STATUSES = ("queued", "running")
+
+# Seconds to remember standardized and rejected structures
+STANDARDIZED_TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+
+standardized_cache = DiskCache(
+    CACHE_PATH,
+    namespace="standardized_smiles",
+    max_entries=int(os.environ.get("STANDARDIZED_CACHE_SIZE", 200000)),
+    ttl=STANDARDIZED_TTL
+)
+
+
+class PugPending(Exception):
+    """PubChem did not finish a job within the allowed polls"""
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate, burst=None):
+        """Token bucket allowing rate requests per second
+
+            :rate (float) - Sustained requests per second
+            :burst (int) - Default = rate - Requests allowed back to back
+        """
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SharedRateLimiter(object):
+
+    # Token bucket kept in a Redis hash and refilled from the Redis clock,
+    # returns the seconds to wait when no token is left
+    SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+           'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, rate, burst=None, key="pubchem:rate"):
+        """Token bucket shared by every process using the same Redis key,
+        so parallel tasks together stay within rate
+
+            :client (redis.Redis) - Connection holding the bucket
+            :rate (float) - Sustained requests per second
+            :burst (int) - Default = rate - Requests allowed back to back
+            :key (str) - Default = "pubchem:rate" - Redis key of the bucket
+        """
+        self.client = client
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.key = key
+        self._script = client.register_script(self.SCRIPT)
+
+    def __repr__(self):
+        return "<SharedRateLimiter(key='%s', rate=%s)>" % (self.key,
+                                                           self.rate)
+
+    @classmethod
+    def from_url(cls, url, rate, **kwargs):
+        return cls(redis.Redis.from_url(url), rate, **kwargs)
+
+    def take(self):
+        """Take a token, returns 0 or the seconds until one is available"""
+        return float(self._script(keys=[self.key],
+                                  args=[self.rate, self.burst]))
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            wait = await loop.run_in_executor(None, self.take)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class PugClient(object):
+
+    def __init__(self, url=urlSend, concurrency=DEFAULT_CONCURRENCY,
+                 rate=DEFAULT_RATE, max_retry=5, poll_interval=1.0,
+                 timeout=30, cache=None, negative_ttl=NEGATIVE_TTL,
+                 limiter=None):
+        """Initialize PugClient object
+
+            :url (str) - Default = PubChem PUG gateway - Service to call
+            :concurrency (int) - Default = 8 - Jobs in flight at once
+            :rate (float) - Default = 5 - HTTP requests per second
+            :max_retry (int) - Default = 5 - Polls per job before giving up
+            :poll_interval (float) - Default = 1.0 - Seconds between polls
+            :timeout (float) - Default = 30 - Seconds allowed per request
+            :cache (DiskCache) - Default = None - Store of previous results,
+                                 None disables caching
+            :negative_ttl (float) - Default = 1 day - Seconds to remember
+                                    structures PubChem rejected
+            :limiter (SharedRateLimiter) - Default = None - Limit shared
+                                           with other clients, None limits
+                                           this client alone to rate
+        """
+        self.url = url
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retry = max_retry
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.cache = cache
+        self.negative_ttl = negative_ttl
+        self.limiter = limiter
+        self.session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = self.limiter or RateLimiter(self.rate)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    async def _post(self, data):
+        await self._limiter.acquire()
+        # Bounded by the caller's deadline, if any
+        timeout = aiohttp.ClientTimeout(total=request_timeout(self.timeout))
+        async with self.session.post(self.url, data=data,
+                                     timeout=timeout) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    async def standardize(self, in_smiles):
+        """Standardize a single SMILES string
+
+        Returns None if PubChem did not finish in time.
+        Raises TypeError for invalid SMILES, ValueError if PubChem rejects
+        the structure, aiohttp.ClientError if it can not be reached and
+        DeadlineExceeded if the active deadline passes
+        """
+        try:
+            return await self._standardize(in_smiles)
+        except PugPending:
+            return None
+
+    async def _standardize(self, in_smiles):
+        if not is_smiles(in_smiles):
+            raise TypeError("Invalid SMILES %s" % in_smiles)
+
+        async with self._semaphore:
+            text = await self._post(
+                pubchem_smile_standarize_string.format(in_smiles))
+            reqid = get_PCT_reqid(text)
+            smiles = get_PCT_smiles(text)
+            counter = 0
+            while not smiles and reqid and counter < self.max_retry:
+                await asyncio.sleep(request_timeout(self.poll_interval))
+                text = await self._post(pubchem_poll_string.format(reqid))
+                status = get_PCT_status(text)
+                if status not in ("success",) + PENDING_STATUSES:
+                    raise ValueError("PUG was unable to standardize %s"
+                                     % in_smiles)
+                smiles = get_PCT_smiles(text)
+                counter += 1
+
+        if not smiles:
+            raise PugPending(in_smiles)
+        return smiles
+
+    async def standardize_many(self, smiles_list):
+        """Standardize SMILES concurrently
+
+        Returns a dict of input SMILES to standardized SMILES, None for
+        any that failed or that PubChem did not finish in time
+        """
+        standardized = {}
+        missing = []
+        for smiles in dict.fromkeys(smiles_list):
+            cached = self._cached(smiles)
+            if cached is None:
+                missing.append(smiles)
+            else:
+                standardized[smiles] = cached["smiles"]
+
+        results = await asyncio.gather(
+            *[self._standardize(s) for s in missing], return_exceptions=True)
+        for smiles, result in zip(missing, results):
+            if isinstance(result, PugPending):
+                # Not an answer from PubChem, left uncached and unset so
+                # the next run tries again
+                logging.warning("PubChem did not finish standardizing %s",
+                                smiles)
+                result = None
+            elif isinstance(result, DeadlineExceeded):
+                logging.error("Timed out standardizing %s", smiles)
+                result = None
+            elif isinstance(result, (TypeError, ValueError)):
+                logging.error("Unable to standardize %s", smiles)
+                logging.error(repr(result))
+                self._remember(smiles, None, ttl=self.negative_ttl)
+                result = None
+            elif isinstance(result, Exception):
+                logging.error("Unable to reach PubChem for %s", smiles)
+                logging.error(repr(result))
+                result = None
+            else:
+                self._remember(smiles, result)
+            standardized[smiles] = result
+        return standardized
+
+    def _cached(self, smiles):
+        if self.cache is None:
+            return None
+        return self.cache.get(DiskCache.make_key(smiles))
+
+    def _remember(self, smiles, result, ttl=None):
+        if self.cache is not None:
+            self.cache.set(DiskCache.make_key(smiles), {"smiles": result},
+                           ttl=ttl)
+
+
+def standardize_smiles_batch(smiles_list, cache=standardized_cache, **kwargs):
+    """Blocking wrapper around PugClient.standardize_many
+
+        :smiles_list (list) - SMILES strings to standardize
+        :cache (DiskCache) - Default = standardized_cache - Store of previous
+                             results, None disables caching
+
+        Other kwargs are passed on to PugClient
+    """
+    async def _run():
+        async with PugClient(cache=cache, **kwargs) as client:
+            return await client.standardize_many(smiles_list)
+
+    return asyncio.run(_run())
+
+
+def standardize_smiles(smiles, **kwargs):
+    """Standardize a single SMILES string through the cache
+
+    Raises TypeError for invalid SMILES and ValueError if it could not
+    be standardized
+    """
+    if not is_smiles(smiles):
+        raise TypeError("Invalid SMILES %s" % smiles)
+    result = standardize_smiles_batch([smiles], **kwargs)[smiles]
+    if result is None:
+        raise ValueError("Unable to standardize %s" % smiles)
+    return result
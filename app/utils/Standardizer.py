@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Interchangeable SMILES standardization backends
+
+    pubchem - PubChem PUG standardization service (network, cached)
+    rdkit   - In-process RDKit normalization, approximating PubChem's
+              cleanup, charge and tautomer rules
+    hybrid  - RDKit, asking PubChem only where RDKit fails or its result
+              is not the same compound by InChIKey
+
+Select one with `get_standardizer(name)`, the default comes from the
+STANDARDIZATION_BACKEND environment variable.
+"""
+import logging
+import os
+
+from rdkit import Chem
+from rdkit.Chem.MolStandardize import rdMolStandardize
+
+from .PugClient import standardize_smiles_batch
+from .pubchem_smiles_standardizer import is_smiles
+
+DEFAULT_STANDARDIZER = os.environ.get("STANDARDIZATION_BACKEND", "pubchem")
+
+
+class Standardizer(object):
+    """Base class, subclasses implement standardize_many"""
+
+    name = None
+
+    def __repr__(self):
+        return "<%s()>" % self.__class__.__name__
+
+    def standardize_many(self, smiles_list):
+        """Return a dict of input SMILES to standardized SMILES, None for
+        any that failed
+        """
+        raise NotImplementedError
+
+    def standardize(self, smiles):
+        """Standardize a single SMILES string
+
+        Raises TypeError for invalid SMILES and ValueError if it could not
+        be standardized
+        """
+        if not is_smiles(smiles):
+            raise TypeError("Invalid SMILES %s" % smiles)
+        result = self.standardize_many([smiles])[smiles]
+        if result is None:
+            raise ValueError("Unable to standardize %s" % smiles)
+        return result
+
+
+class PubChemStandardizer(Standardizer):
+
+    name = "pubchem"
+
+    def __init__(self, **kwargs):
+        """kwargs are passed on to PugClient"""
+        self.kwargs = kwargs
+
+    def standardize_many(self, smiles_list):
+        return standardize_smiles_batch(smiles_list, **self.kwargs)
+
+
+class RDKitStandardizer(Standardizer):
+
+    name = "rdkit"
+
+    def __init__(self, max_tautomers=1000):
+        """Initialize RDKitStandardizer object
+
+            :max_tautomers (int) - Default = 1000 - Tautomers enumerated
+                                   before picking the canonical one
+        """
+        params = rdMolStandardize.CleanupParameters()
+        params.maxTautomers = max_tautomers
+        # PubChem keeps stereochemistry, the RDKit defaults drop it
+        params.tautomerRemoveSp3Stereo = False
+        params.tautomerRemoveBondStereo = False
+        params.tautomerReassignStereo = True
+        self.params = params
+        self._enumerator = rdMolStandardize.TautomerEnumerator(params)
+
+    def standardize_mol(self, mol):
+        """Cleanup, normalize, reionize and pick the canonical tautomer"""
+        mol = rdMolStandardize.Cleanup(mol, self.params)
+        return self._enumerator.Canonicalize(mol)
+
+    def standardize_many(self, smiles_list):
+        standardized = {}
+        for smiles in dict.fromkeys(smiles_list):
+            try:
+                mol = Chem.MolFromSmiles(smiles)
+                if mol is None:
+                    raise TypeError("Invalid SMILES %s" % smiles)
+                standardized[smiles] = to_pubchem_smiles(
+                    self.standardize_mol(mol))
+            except (TypeError, ValueError, RuntimeError) as e:
+                logging.error("Unable to standardize %s", smiles)
+                logging.error(repr(e))
+                standardized[smiles] = None
+        return standardized
+
+
+class HybridStandardizer(Standardizer):
+
+    name = "hybrid"
+
+    def __init__(self, local, remote):
+        """Initialize HybridStandardizer object
+
+            :local (Standardizer) - Tried first for every structure
+            :remote (Standardizer) - Used where local fails or disagrees
+        """
+        self.local = local
+        self.remote = remote
+
+    def standardize_many(self, smiles_list):
+        standardized = self.local.standardize_many(smiles_list)
+        disagreements = [s for s, result in standardized.items()
+                         if not same_compound(s, result)]
+        if disagreements:
+            logging.info("Standardizing %d structures remotely",
+                         len(disagreements))
+            for smiles, result in \
+                    self.remote.standardize_many(disagreements).items():
+                if result is not None:
+                    standardized[smiles] = result
+        return standardized
+
+
+def to_pubchem_smiles(mol):
+    """Kekulized SMILES, the form PubChem returns"""
+    mol = Chem.Mol(mol)
+    Chem.Kekulize(mol, clearAromaticFlags=True)
+    return Chem.MolToSmiles(mol, kekuleSmiles=True)
+
+
+def same_compound(smiles, standardized):
+    """True if both SMILES have the same InChIKey ignoring protonation"""
+    if not standardized:
+        return False
+    keys = []
+    for s in (smiles, standardized):
+        mol = Chem.MolFromSmiles(s)
+        if mol is None:
+            return False
+        keys.append(Chem.MolToInchiKey(mol)[:25])
+    return keys[0] == keys[1]
+
+
+def get_standardizer(name=None, **kwargs):
+    """Create the named standardization backend
+
+        :name (str) - Default = STANDARDIZATION_BACKEND - pubchem, rdkit
+                      or hybrid
+
+        kwargs are passed on to PugClient for backends using PubChem
+    """
+    name = name or DEFAULT_STANDARDIZER
+    if name == "rdkit":
+        return RDKitStandardizer()
+    elif name == "pubchem":
+        return PubChemStandardizer(**kwargs)
+    elif name == "hybrid":
+        return HybridStandardizer(RDKitStandardizer(),
+                                  PubChemStandardizer(**kwargs))
+    raise ValueError("Unknown standardization backend %s" % name)
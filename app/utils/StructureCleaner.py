@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Salt stripping, neutralisation and fragment removal for RDKit Mols
+
+Salt definitions and charge patterns are compiled once when the module is
+imported and applied to Mol objects in place, without SMILES round trips.
+
+Usage:
+`from app.utils.StructureCleaner import structure_cleaner`
+
+`mol, neutralized, defragmented = structure_cleaner.clean(mol)`
+"""
+from rdkit import Chem
+from rdkit.Chem import SaltRemover
+
+# Charged atoms to neutralise, adapted from
+# http://www.rdkit.org/docs/Cookbook.html
+NEUTRALISATION_PATTERNS = (
+    # Imidazoles
+    '[n+;H]',
+    # Amines
+    '[N+;!H0]',
+    # Carboxylic acids and alcohols
+    '[$([O-]);!$([O-][#7])]',
+    # Thiols
+    '[S-;X1]',
+    # Sulfonamides
+    '[$([N-;X2]S(=O)=O)]',
+    # Enamines
+    '[$([N-;X2][C,N]=C)]',
+    # Tetrazoles
+    '[n-]',
+    # Sulfoxides
+    '[$([S-]=O)]',
+    # Amides
+    '[$([N-]C=O)]',
+)
+
+
+class StructureCleaner(object):
+
+    def __init__(self, patterns=NEUTRALISATION_PATTERNS):
+        """Initialize StructureCleaner object
+
+            :patterns (tuple) - Default = NEUTRALISATION_PATTERNS - SMARTS
+                                matching charged atoms to neutralise
+        """
+        self.salt_remover = SaltRemover.SaltRemover()
+        self.patterns = [Chem.MolFromSmarts(x) for x in patterns]
+
+    def __repr__(self):
+        return "<StructureCleaner(patterns=%d)>" % len(self.patterns)
+
+    def strip_salts(self, mol):
+        """Return (mol, stripped) with known counterions removed"""
+        stripped, deleted = self.salt_remover.StripMolWithDeleted(
+            mol, dontRemoveEverything=True)
+        return stripped, bool(deleted)
+
+    def neutralize(self, mol):
+        """Return (mol, neutralized) with charged groups protonated or
+        deprotonated to their neutral forms
+        """
+        mol = Chem.Mol(mol)
+        neutralized = False
+        for pattern in self.patterns:
+            for match in mol.GetSubstructMatches(pattern):
+                atom = mol.GetAtomWithIdx(match[0])
+                charge = atom.GetFormalCharge()
+                if charge == 0:
+                    continue
+                hydrogens = atom.GetTotalNumHs()
+                atom.SetFormalCharge(0)
+                atom.SetNumExplicitHs(max(0, hydrogens - charge))
+                atom.SetNoImplicit(True)
+                atom.UpdatePropertyCache()
+                neutralized = True
+        if neutralized:
+            Chem.SanitizeMol(mol)
+        return mol, neutralized
+
+    @staticmethod
+    def largest_fragment(mol):
+        """Return (mol, defragmented) keeping the fragment with most atoms"""
+        fragments = Chem.GetMolFrags(mol, asMols=True)
+        if len(fragments) < 2:
+            return mol, False
+        return max(fragments, key=lambda x: x.GetNumAtoms()), True
+
+    def clean(self, mol):
+        """Strip salts, neutralise and keep the largest fragment
+
+        Returns (mol, neutralized, defragmented)
+        """
+        mol, stripped = self.strip_salts(mol)
+        mol, neutralized = self.neutralize(mol)
+        mol, defragmented = self.largest_fragment(mol)
+        return mol, neutralized, stripped or defragmented
+
+    def clean_many(self, mols):
+        """clean for each Mol in mols, returns a list of results"""
+        return [self.clean(mol) for mol in mols]
+
+
+structure_cleaner = StructureCleaner()
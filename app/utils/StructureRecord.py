@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Compact, picklable record of a compound's computed structure data
+
+Holds no RDKit molecule, so records are cheap to keep for a whole dataset
+and to pass between processes.
+"""
+
+
+class StructureRecord(object):
+
+    __slots__ = ("name", "smiles", "inchi", "inchikey", "formula",
+                 "accurate_mass", "mass", "m_plus_h", "m_plus_na", "molblock")
+
+    def __init__(self, **kwargs):
+        """Initialize StructureRecord object
+
+            kwargs:
+            One per slot, any not given are None
+        """
+        for field in self.__slots__:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError("Unexpected fields: %s" % ", ".join(kwargs))
+
+    def __repr__(self):
+        return "<StructureRecord(name='%s', inchikey='%s')>" % (
+            self.name, self.inchikey)
+
+    def __eq__(self, other):
+        if not isinstance(other, StructureRecord):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __getstate__(self):
+        return self.to_tuple()
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def to_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_compound(cls, compound):
+        """Record every property of a Compound"""
+        return cls(**{field: getattr(compound, field)
+                      for field in cls.__slots__})
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Fuzzy lookup of names by character n-grams
+
+Candidates sharing n-grams with the query are found through an inverted
+index, scored by n-gram overlap and the best few re-ranked by edit
+similarity. Several names may point at the same value (e.g. known
+misspellings of a genus), each value is suggested once.
+"""
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+
+class SuggestionIndex(object):
+
+    def __init__(self, n=3, candidates=30):
+        """Initialize SuggestionIndex object
+
+            :n (int) - Default = 3 - Length of the character n-grams
+            :candidates (int) - Default = 30 - Best n-gram matches re-ranked
+                                by edit similarity
+        """
+        self.n = n
+        self.candidates = candidates
+        self._keys = []
+        self._values = []
+        self._sizes = []
+        self._seen = set()
+        self._postings = defaultdict(list)
+
+    def __repr__(self):
+        return "<SuggestionIndex(names=%d)>" % len(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, name, value):
+        """Suggest value for queries resembling name"""
+        key = suggestion_key(name)
+        if not key or (key, value) in self._seen:
+            return
+        self._seen.add((key, value))
+        grams = self._ngrams(key)
+        idx = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        self._sizes.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(idx)
+
+    def suggest(self, name, limit=5, cutoff=0.6):
+        """Values whose names best match name, most similar first
+
+            :limit (int) - Default = 5 - Most values returned
+            :cutoff (float) - Default = 0.6 - Minimum edit similarity (0-1)
+        """
+        key = suggestion_key(name)
+        if not key:
+            return []
+        grams = self._ngrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for idx in self._postings.get(gram, ()):
+                shared[idx] += 1
+
+        # Dice coefficient of the n-gram sets
+        size = len(grams)
+        best = sorted(shared, key=lambda idx: -2. * shared[idx] /
+                      (size + self._sizes[idx]))[:self.candidates]
+
+        matcher = SequenceMatcher(b=key, autojunk=False)
+        scored = []
+        for idx in best:
+            matcher.set_seq1(self._keys[idx])
+            if matcher.real_quick_ratio() < cutoff:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= cutoff:
+                scored.append((-ratio, idx))
+        scored.sort()
+
+        suggestions = []
+        for _, idx in scored:
+            if self._values[idx] not in suggestions:
+                suggestions.append(self._values[idx])
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+    def _ngrams(self, key):
+        padded = " %s " % key
+        return {padded[i:i + self.n]
+                for i in range(max(1, len(padded) - self.n + 1))}
+
+
+def suggestion_key(name):
+    """Case, period and spacing insensitive form of name"""
+    if not name:
+        return ""
+    return re.sub(r"\s+", " ", name.casefold().replace(".", " ")).strip()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Mass spectrometry adducts with precomputed exact masses
+
+Ion masses are the RDKit exact masses of the charged species (electron
+mass accounted for), e.g. `Descriptors.ExactMolWt(Chem.MolFromSmiles('[H+]'))`,
+so results match what Compound computed before the table existed.
+
+Usage:
+`from app.utils.adducts import adduct_mz, adduct_table`
+
+`adduct_mz(180.0634, "[M+Na]+")` - m/z of a single adduct
+`adduct_table(masses)` - m/z of every adduct for an array of masses
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+PROTON_MASS = 1.00727645209
+SODIUM_ION_MASS = 22.98922070009
+POTASSIUM_ION_MASS = 38.96315810009
+AMMONIUM_ION_MASS = 18.03382554809
+CHLORIDE_ION_MASS = 34.96940125991
+FORMATE_ION_MASS = 44.99820285191
+ACETATE_ION_MASS = 59.01385291591
+
+# Adduct name -> (molecules, mass added, charge)
+ADDUCTS = OrderedDict([
+    ("[M+H]+", (1, PROTON_MASS, 1)),
+    ("[M+Na]+", (1, SODIUM_ION_MASS, 1)),
+    ("[M+K]+", (1, POTASSIUM_ION_MASS, 1)),
+    ("[M+NH4]+", (1, AMMONIUM_ION_MASS, 1)),
+    ("[M+2H]2+", (1, 2 * PROTON_MASS, 2)),
+    ("[2M+H]+", (2, PROTON_MASS, 1)),
+    ("[2M+Na]+", (2, SODIUM_ION_MASS, 1)),
+    ("[M-H]-", (1, -PROTON_MASS, -1)),
+    ("[M+Cl]-", (1, CHLORIDE_ION_MASS, -1)),
+    ("[M+HCOO]-", (1, FORMATE_ION_MASS, -1)),
+    ("[M+CH3COO]-", (1, ACETATE_ION_MASS, -1)),
+    ("[M-2H]2-", (1, -2 * PROTON_MASS, -2)),
+    ("[2M-H]-", (2, -PROTON_MASS, -1)),
+])
+
+POSITIVE_ADDUCTS = [k for k, v in ADDUCTS.items() if v[2] > 0]
+NEGATIVE_ADDUCTS = [k for k, v in ADDUCTS.items() if v[2] < 0]
+
+
+def adduct_mz(accurate_mass, adduct, decimals=4):
+    """m/z of one adduct of a neutral accurate mass
+
+        :accurate_mass (float) - Monoisotopic mass of the neutral compound
+        :adduct (str) - Key of ADDUCTS, e.g. "[M+H]+"
+        :decimals (int) - Default = 4 - Rounding applied to the result
+    """
+    molecules, shift, charge = ADDUCTS[adduct]
+    return round((molecules * accurate_mass + shift) / abs(charge), decimals)
+
+
+def adduct_table(masses, adducts=None, decimals=4):
+    """m/z of several adducts for many masses at once
+
+        :masses (array like) - Monoisotopic masses of neutral compounds
+        :adducts (list) - Default = every adduct in ADDUCTS
+        :decimals (int) - Default = 4 - Rounding applied to the result
+
+    Returns an array of shape (len(masses), len(adducts))
+    """
+    adducts = list(ADDUCTS) if adducts is None else list(adducts)
+    molecules, shifts, charges = np.array(
+        [ADDUCTS[x] for x in adducts], dtype=float).T
+    masses = np.asarray(masses, dtype=float)
+    mz = (np.outer(masses, molecules) + shifts) / np.abs(charges)
+    return np.round(mz, decimals)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Helpers for working through data in fixed size batches
+"""
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """Yield successive lists of at most size items from iterable"""
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
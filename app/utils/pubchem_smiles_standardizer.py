@@ -3,6 +3,8 @@ import time
 import requests
 from rdkit import Chem
 
+from .timeout import check_deadline, request_timeout
+
 """
 PubChem Smiles Standardization:
 author: Jeff van Santen
@@ -30,6 +32,7 @@ TypeError       - Uses rdkit check if SMILES string is a compound raise TypeErro
 ValueError      - If unable to to reach PubChem for some unknown reason
 ConnectionError - If requests library is unable to reach PubChem
 (Note the last two can be considered as redundant)
+DeadlineExceeded - If called under app.utils.timeout.deadline and it passes
 """
 
 def get_standardized_smiles(in_smiles, max_retry=3):
@@ -38,7 +41,8 @@ def get_standardized_smiles(in_smiles, max_retry=3):
     if not is_smiles(in_smiles):
         raise TypeError
 
-    request1 = requests.post(url=urlSend, data=pubchem_smile_standarize_string.format(in_smiles))
+    request1 = requests.post(url=urlSend, data=pubchem_smile_standarize_string.format(in_smiles),
+                             timeout=request_timeout(30))
     if request1.status_code == requests.codes.ok:
         reqid = get_PCT_reqid(request1.text)
         smiles = None
@@ -61,7 +65,8 @@ def get_standardized_smiles(in_smiles, max_retry=3):
             smiles = get_PCT_smiles(request2.text)
 
             # Sleep for a second if didn't get smiles
-            time.sleep(1)
+            time.sleep(request_timeout(1))
+            check_deadline()
             counter += 1
         if not smiles:
           smiles = in_smiles
@@ -125,7 +130,8 @@ def get_PCT_reqid(request_text):
             break
     return reqid
 
-def check_PCT_status(request_text):
+def get_PCT_status(request_text):
+    code = "none"
     for l in request_text.split('\n'):
         if "<PCT-Status value=" in l:
             try:
@@ -133,7 +139,10 @@ def check_PCT_status(request_text):
             except AttributeError:
                 code = "none"
             break
-    return True if code == "success" else False
+    return code
+
+def check_PCT_status(request_text):
+    return True if get_PCT_status(request_text) == "success" else False
 
 def get_PCT_smiles(request_text):
     smiles = None
@@ -144,7 +153,8 @@ def get_PCT_smiles(request_text):
     return smiles
 
 def poll_PCT(request_id):
-    return requests.post(url=urlSend, data=pubchem_poll_string.format(request_id))
+    return requests.post(url=urlSend, data=pubchem_poll_string.format(request_id),
+                         timeout=request_timeout(30))
 
 def is_smiles(smiles):
     return bool(Chem.MolFromSmiles(smiles)) and bool(smiles)
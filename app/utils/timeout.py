@@ -1,5 +1,9 @@
+import contextvars
+import functools
 import sys
 import threading
+import time
+from contextlib import contextmanager
 from time import sleep
 import logging
 try:
@@ -19,6 +23,7 @@ def exit_after(s):
     '''
     use as decorator to exit process if
     function takes longer than s seconds
+    only works from the main thread, prefer with_deadline
     '''
     def outer(fn):
         def inner(*args, **kwargs):
@@ -30,4 +35,97 @@ def exit_after(s):
                 timer.cancel()
             return result
         return inner
-    return outer
\ No newline at end of file
+    return outer
+
+
+class DeadlineExceeded(Exception):
+    """Raised when work runs past its deadline"""
+
+
+class Deadline(object):
+
+    def __init__(self, seconds):
+        """Point in time by which work must finish
+
+            :seconds (float) - Seconds from now until the deadline
+        """
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def __repr__(self):
+        return "<Deadline(remaining=%.2f)>" % self.remaining()
+
+    def remaining(self):
+        return max(0., self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def check(self):
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if self.expired():
+            raise DeadlineExceeded(
+                "Deadline of {0}s exceeded".format(self.seconds))
+
+    def timeout(self, cap=None):
+        """Seconds a blocking call may take, at most cap"""
+        self.check()
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+
+# Deadlines follow the thread or asyncio task that set them
+_current_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline():
+    """Innermost active Deadline or None"""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline(seconds):
+    """Run the enclosed block under a deadline
+
+    Nested deadlines can only shorten the time allowed. Code inside the
+    block checks the deadline cooperatively and bounds its socket timeouts
+    with request_timeout, nothing is interrupted from the outside
+    """
+    new = Deadline(seconds)
+    outer = _current_deadline.get()
+    if outer is not None and outer.expires < new.expires:
+        new = outer
+    token = _current_deadline.set(new)
+    try:
+        yield new
+    finally:
+        _current_deadline.reset(token)
+
+
+def with_deadline(s):
+    '''
+    use as decorator to raise DeadlineExceeded if
+    function takes longer than s seconds, safe to use from any thread
+    '''
+    def outer(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with deadline(s):
+                return fn(*args, **kwargs)
+        return inner
+    return outer
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the active deadline has passed"""
+    active = current_deadline()
+    if active is not None:
+        active.check()
+
+
+def request_timeout(default):
+    """Socket timeout for a request, bounded by the active deadline"""
+    active = current_deadline()
+    if active is None:
+        return default
+    return active.timeout(default)
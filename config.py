@@ -1,3 +1,6 @@
+import os
+
+
 class Config(object):
     """
     Common configurations
@@ -6,6 +9,21 @@ class Config(object):
     DEBUG = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False 
 
+    # PubChem standardization: jobs in flight and HTTP requests per second
+    PUBCHEM_CONCURRENCY = 8
+    PUBCHEM_RATE_LIMIT = 5
+    # Redis keeping the rate limit shared by parallel standardization
+    # tasks, None limits every task separately
+    PUBCHEM_RATE_LIMIT_REDIS = "redis://{}:6379".format(
+        os.environ.get("REDIS", "127.0.0.1"))
+    # pubchem, rdkit or hybrid, see app/utils/Standardizer.py
+    STANDARDIZATION_BACKEND = os.environ.get("STANDARDIZATION_BACKEND",
+                                             "pubchem")
+    # Compounds per standardization sub-task
+    STANDARDIZE_CHUNK_SIZE = 200
+    # Articles inserted into the Atlas per transaction
+    INSERT_CHUNK_SIZE = 10
+
 
 class DevelopmentConfig(Config):
     """
@@ -0,0 +1,101 @@
+"""Benchmark compound name regularization against the original algorithm
+
+Usage:
+`python scripts/benchmark_regularize_name.py --size 200000`
+`python scripts/benchmark_regularize_name.py --names names.txt`
+
+Checks every name of the corpus gives the same result with both
+implementations, then times each (memoized one cold and warm).
+"""
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+import random
+import re
+import time
+from difflib import SequenceMatcher
+
+import click
+
+from app.checker.NameString import (NOT_NAMED_SYNONYMS, SUFFIX_LIST,
+                                    regularize_name)
+
+STEMS = ('jacobine', 'Streptomycin', 'penicillic', 'aspergillin', 'Tricycline',
+         'DiMethyl', 'epoxy', 'hydroxy', 'Aglyconol', 'nor', 'iso')
+LETTERS = ('a', 'b', 'c1', 'ab', 'A', 'B2', 'x3')
+UNNAMED = NOT_NAMED_SYNONYMS + ('unkown', 'not-named', 'un-named', 'non')
+
+
+def legacy_regularize_name(name):
+    """The original NameString algorithm, kept for comparison"""
+    if any(SequenceMatcher(None, name.lower(), x).ratio() > 0.75
+           for x in NOT_NAMED_SYNONYMS):
+        name = 'Not named'
+    regexp = '\\b({0})\\b'.format('|'.join(SUFFIX_LIST))
+    res = re.search(regexp, name)
+    while res:
+        res = res.group()
+        name = re.sub(res, res.lower(), name)
+        res = re.search(regexp, name)
+    if re.match('^[A-Za-z]', name):
+        name = name[0].upper() + name[1:]
+    regexp = re.compile(r'(\b[a-z]{1,2}\d?)$')
+    match = regexp.search(name)
+    if match:
+        name = regexp.sub(match.group().upper(), name)
+    return name
+
+
+def random_name(rng):
+    if rng.random() < 0.05:
+        return rng.choice(UNNAMED)
+    words = [rng.choice(STEMS) for _ in range(rng.randint(1, 3))]
+    words += rng.sample(SUFFIX_LIST, rng.randint(0, 2))
+    if rng.random() < 0.5:
+        words.append(rng.choice(LETTERS))
+    return ' '.join(words)
+
+
+def timed(func, names):
+    start = time.perf_counter()
+    for name in names:
+        func(name)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--size", default=100000, help="Names in the generated corpus")
+@click.option("--unique", default=20000, help="Distinct generated names")
+@click.option("--names", type=click.File(), help="File with one name per line")
+@click.option("--seed", default=0)
+def run_benchmark(size, unique, names, seed):
+    if names:
+        corpus = [x.rstrip("\n") for x in names if x.strip()]
+    else:
+        rng = random.Random(seed)
+        distinct = [random_name(rng) for _ in range(unique)]
+        corpus = [rng.choice(distinct) for _ in range(size)]
+    click.echo("%d names, %d distinct" % (len(corpus), len(set(corpus))))
+
+    regularize_name.cache_clear()
+    mismatches = [x for x in set(corpus)
+                  if legacy_regularize_name(x) != regularize_name(x)]
+    for name in mismatches[:10]:
+        click.echo("MISMATCH %r: %r != %r" % (
+            name, legacy_regularize_name(name), regularize_name(name)))
+    if mismatches:
+        sys.exit(1)
+
+    legacy = timed(legacy_regularize_name, corpus)
+    regularize_name.cache_clear()
+    cold = timed(regularize_name, corpus)
+    warm = timed(regularize_name, corpus)
+    for label, seconds in (("legacy", legacy), ("memoized (cold)", cold),
+                           ("memoized (warm)", warm)):
+        click.echo("%-16s %8.3fs %8.2fus/name %6.1fx" % (
+            label, seconds, 1e6 * seconds / len(corpus), legacy / seconds))
+
+
+if __name__ == "__main__":
+    run_benchmark()
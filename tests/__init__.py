@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Keep the persistent caches of the tests out of the project
+_cache_dir = tempfile.TemporaryDirectory(prefix="curator_cache")
+os.environ["CURATOR_CACHE_DIR"] = _cache_dir.name
@@ -1,6 +1,7 @@
 import sys
 sys.path.append("..")
-from app.checker.NameString import NameString
+from app.checker.NameString import (NameString, decapitalize_suffixes,
+                                    regularize_name)
 
 import unittest
 
@@ -56,3 +57,30 @@ class TestNameString(unittest.TestCase):
             name_obj = NameString(name[0])
             name_obj.regularize_name()
         self.assertEqual(name_obj.get_name(), name[1])
+
+    def test_regularize_name_memoized(self):
+        regularize_name.cache_clear()
+        for name in TEST_NAME_TUPLES:
+            self.assertEqual(regularize_name(name[0]), name[1])
+            self.assertEqual(regularize_name(name[0]), name[1])
+        self.assertEqual(regularize_name.cache_info().hits,
+                         len(TEST_NAME_TUPLES))
+
+    def test_regularize_unnamed_long_name(self):
+        self.assertEqual(regularize_name('unnamed compound'),
+                         'Unnamed compound')
+
+    def test_decapitalize_suffixes_anywhere(self):
+        self.assertEqual(decapitalize_suffixes('DiMethyl Methyl'),
+                         'Dimethyl methyl')
+        self.assertEqual(decapitalize_suffixes('Aglycon XAglyconeY'),
+                         'aglycon XaglyconeY')
+        self.assertEqual(decapitalize_suffixes('DiMethyl'), 'DiMethyl')
+
+    def test_decapitalize_suffixes_exposed(self):
+        # Lowering Ethyl makes )Methyl a suffix word too
+        self.assertEqual(decapitalize_suffixes('Ethyl )MEthyl non'),
+                         'ethyl )methyl non')
+        self.assertEqual(regularize_name('Ethyl )MEthyl non'),
+                         'Ethyl )methyl non')
+
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+import unittest
+
+from sqlalchemy import create_engine
+
+from app.utils.atlasdb import AtlasDB
+from app.utils.AtlasIndex import AtlasIndex
+
+
+class TestAtlasIndex(unittest.TestCase):
+    """Tests for AtlasIndex using an in-memory Atlas"""
+
+    def setUp(self):
+        self.atlas = AtlasDB()
+        self.atlas.engine = create_engine("sqlite://")
+        self.atlas.metadata.create_all(self.atlas.engine)
+        sess = self.atlas.startSession()
+        sess.add_all([
+            self.atlas.Compound(id=1, inchi="InChI=1S/A",
+                                inchikey="JGSARLDLIJGVTE-MBNYWOFBSA-N"),
+            self.atlas.Compound(id=2, inchi="InChI=1S/B",
+                                inchikey="VNWKTOKETHGBQD-UHFFFAOYSA-N"),
+            self.atlas.Name(id=1, name="Penicillin G"),
+        ])
+        sess.commit()
+        sess.close()
+        self.index = AtlasIndex(self.atlas)
+        self.index.refresh()
+
+    def test_refresh(self):
+        self.assertTrue(self.index.loaded)
+        self.assertEqual(len(self.index), 2)
+
+    def test_full_match(self):
+        self.assertTrue(self.index.has_inchikey("JGSARLDLIJGVTE-MBNYWOFBSA-N"))
+        self.assertFalse(self.index.has_inchikey("JGSARLDLIJGVTE-UHFFFAOYSA-N"))
+
+    def test_flat_match(self):
+        self.assertTrue(self.index.has_block("JGSARLDLIJGVTE-UHFFFAOYSA-N"))
+        self.assertFalse(self.index.has_block("QVGXLLKOCUKJST-UHFFFAOYSA-N"))
+
+    def test_get_inchikey(self):
+        self.assertEqual(self.index.get_inchikey(2),
+                         "VNWKTOKETHGBQD-UHFFFAOYSA-N")
+        self.assertIsNone(self.index.get_inchikey(3))
+
+
+class TestAtlasIndexPartialLoad(TestAtlasIndex):
+    """Same checks against an index loaded only for given structures"""
+
+    def setUp(self):
+        super(TestAtlasIndexPartialLoad, self).setUp()
+        self.index = AtlasIndex(self.atlas)
+        self.index.load(
+            inchikeys=["JGSARLDLIJGVTE-UHFFFAOYSA-N",
+                       "QVGXLLKOCUKJST-UHFFFAOYSA-N"],
+            compound_ids=[2],
+            chunk_size=1
+        )
+
+    def test_refresh(self):
+        self.assertFalse(self.index.loaded)
+        self.assertEqual(len(self.index), 2)
+
+    def test_name_match(self):
+        self.index.load_names(["Penicillin G", "Not a name"])
+        self.assertTrue(self.index.has_name("penicillin G"))
+        self.assertFalse(self.index.has_name("Not a name"))
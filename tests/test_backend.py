@@ -1,8 +1,13 @@
+from types import SimpleNamespace
+
 from flask import abort, url_for
 from flask_testing import TestCase
 
 from app import create_app, db
-from app.models import Article, Compound, Curator, Dataset
+from app.models import (AltGenus, AltJournal, Article, Compound, Curator,
+                        Dataset, Genus, Journal, Problem, Retraction)
+from app.checker.Checker import Checker
+from app.checker.Resolver import Resolver
 
 
 class TestBase(TestCase):
@@ -168,6 +173,116 @@ class TestModels(TestBase):
         self.assertEqual(Dataset.query.first().articles[0].compounds[0].name, 'Methane')
 
 
+class TestResolver(TestBase):
+
+    def setUp(self):
+        super(TestResolver, self).setUp()
+        genus = Genus(genus='Streptomyces', genustype='Bacterium')
+        journal = Journal(journal='J. Nat. Prod.', abbrev='J Nat Prod')
+        db.session.add_all([
+            genus, journal,
+            AltGenus(altgenus='streptomyses', genus=genus),
+            AltJournal(altjournal='jnatprod', journal=journal)
+        ])
+        db.session.commit()
+        self.resolver = Resolver()
+        self.resolver.refresh()
+
+    def test_journal_match(self):
+        for name in ('J. Nat. Prod.', 'j nat prod', 'J.NatProd'):
+            self.assertEqual(self.resolver.match_journal(name).abbrev,
+                             'J Nat Prod')
+        self.assertIsNone(self.resolver.match_journal('Unknown'))
+
+    def test_genus_match(self):
+        self.assertEqual(self.resolver.match_genus('streptomyces '),
+                         'Streptomyces')
+        self.assertEqual(self.resolver.match_genus('Streptomyses'),
+                         'Streptomyces')
+        self.assertIsNone(self.resolver.match_genus('Fakeus'))
+
+    def test_add_entries(self):
+        self.resolver.add_genus('Fakeus')
+        self.resolver.add_alt_journal('JNP', 'J. Nat. Prod.')
+        self.assertEqual(self.resolver.match_genus('fakeus'), 'Fakeus')
+        self.assertEqual(self.resolver.match_journal('J.N.P.').journal,
+                         'J. Nat. Prod.')
+
+
+class TestRetractions(TestBase):
+
+    def setUp(self):
+        super(TestRetractions, self).setUp()
+        db.session.add_all([
+            Retraction(article_doi='10.1021/np0000001'),
+            Retraction(compound_inchikey='LFQSCWFLJHTTHZ-UHFFFAOYSA-N'),
+            Retraction(compound_name='Fakemycin A'),
+        ])
+        db.session.commit()
+        self.checker = Checker(1)
+        self.checker.load_retractions()
+
+    def test_reject_article(self):
+        self.assertTrue(self.checker.check_reject_article(
+            SimpleNamespace(doi='10.1021/NP0000001')))
+        self.assertFalse(self.checker.check_reject_article(
+            SimpleNamespace(doi='10.1021/np0000002')))
+        self.assertIsNone(self.checker.check_reject_article(
+            SimpleNamespace(doi=None)))
+
+    def test_reject_compound(self):
+        self.assertTrue(self.checker.check_reject_compound(
+            SimpleNamespace(inchikey='LFQSCWFLJHTTHZ-UHFFFAOYSA-N',
+                            name=None)))
+        self.assertTrue(self.checker.check_reject_compound(
+            SimpleNamespace(inchikey=None, name='fakemycin a')))
+        # Rows without a field never match compounds missing it
+        self.assertFalse(self.checker.check_reject_compound(
+            SimpleNamespace(inchikey=None, name=None)))
+
+
+class TestReviewList(TestBase):
+
+    def setUp(self):
+        super(TestReviewList, self).setUp()
+        self.checker = Checker(1)
+        self.checker.add_problem(1, "doi")
+        self.checker.add_problem(1, "journal",
+                                 suggestions=[{"value": "J. Nat. Prod."}])
+        self.checker.save_review_list()
+        Problem.query.update({Problem.resolved: True})
+        db.session.commit()
+
+    def test_save_review_list_diff(self):
+        self.checker.review_list = []
+        self.checker.add_problem(1, "journal",
+                                 suggestions=[{"value": "Org. Lett."}])
+        self.checker.add_problem(1, "year")
+        self.checker.save_review_list(diff=True)
+        problems = {x.problem: x for x in Problem.query}
+        self.assertEqual(sorted(problems), ["journal", "year"])
+        # Found again, so reopened with the new suggestions
+        self.assertFalse(problems["journal"].resolved)
+        self.assertEqual(problems["journal"].get_suggestions(),
+                         [{"value": "Org. Lett."}])
+        self.assertFalse(problems["year"].resolved)
+
+    def test_save_review_list_duplicates(self):
+        db.session.add(Problem(dataset_id=1, article_id=1, problem="doi"))
+        db.session.commit()
+        self.checker.review_list = []
+        self.checker.add_problem(1, "doi")
+        self.checker.save_review_list(diff=True)
+        self.assertEqual(Problem.query.filter_by(problem="doi").count(), 1)
+
+    def test_save_review_list_chunks(self):
+        self.checker.review_list = []
+        for i in range(1201):
+            self.checker.add_problem(i, "doi")
+        self.checker.save_review_list()
+        self.assertEqual(Problem.query.count(), 1201)
+
+
 class TestViews(TestBase):
 
     def test_homepage_view(self):
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+import json
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+from app.checker.ChangeLog import (Change, ChangeLogIndex, ChangeLogWriter,
+                                   npaid_to_id)
+
+
+class TestChangeLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_log(self, name, changes, **header):
+        path = os.path.join(self.dir, name)
+        with ChangeLogWriter(path, **header) as log:
+            log.write_many(changes)
+        return path
+
+    def test_write(self):
+        path = self.write_log("change_1.jsonl", [
+            Change("Compound", 12345, "smiles", 'C"C', "CC,O"),
+            Change("Compound", 12345, "m_plus_H", Decimal("1.0000"), 47.0492),
+        ], dataset_id=3)
+        with open(path) as f:
+            records = [json.loads(x) for x in f]
+        self.assertEqual(records[0]["type"], "header")
+        self.assertEqual(records[0]["dataset_id"], 3)
+        self.assertEqual(records[1]["old_value"], 'C"C')
+        self.assertEqual(records[1]["new_value"], "CC,O")
+        self.assertEqual(records[2]["old_value"], "1.0000")
+
+    def test_index(self):
+        self.write_log("change_1.jsonl", [
+            Change("Compound", 12345, "smiles", "C", "CC"),
+            Change("Reference", 7, "doi", None, "10.1/x"),
+        ], dataset_id=1)
+        self.write_log("change_2.jsonl", [
+            Change("Compound", 12345, None, None, None, action="insert"),
+        ], dataset_id=2)
+        index = ChangeLogIndex.from_dir(self.dir)
+        changes = index.compound("NPA012345")
+        self.assertEqual([x["dataset_id"] for x in changes], [1, 2])
+        self.assertEqual(changes[1]["action"], "insert")
+        self.assertEqual(index.reference(7)[0]["new_value"], "10.1/x")
+        self.assertEqual(index.compound(1), [])
+
+    def test_truncated_log(self):
+        path = self.write_log("change_1.jsonl", [
+            Change("Compound", 1, "smiles", "C", "CC")])
+        with open(path, "a") as f:
+            f.write('{"class": "Compound", "db_id": 1, "attr')
+        self.assertEqual(len(ChangeLogIndex.from_dir(self.dir)), 1)
+
+    def test_legacy_log(self):
+        with open(os.path.join(self.dir, "change_0.log"), "w") as f:
+            f.write("# Curator 1 = admin\n# Insert Date: 20190101_000000\n"
+                    '"CLASS","DB_ID","ATTRIBUTE","OLD_VALUE","NEW_VALUE"\n'
+                    '"Compound","42","smiles","C","CC"')
+        self.assertEqual(
+            ChangeLogIndex.from_dir(self.dir).compound(42)[0]["new_value"],
+            "CC")
+
+    def test_npaid(self):
+        self.assertEqual(npaid_to_id("NPA012345"), 12345)
+        self.assertEqual(npaid_to_id(" npa1 "), 1)
+        self.assertEqual(npaid_to_id(12345), 12345)
+        self.assertRaises(ValueError, npaid_to_id, "NPB1")
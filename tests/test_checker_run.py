@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+from datetime import datetime
+
+from flask_testing import TestCase
+from sqlalchemy import create_engine
+
+from app import create_app, db
+from app.models import (Article, CheckerDataset, Compound, Curator, Dataset,
+                        Genus, Journal, Problem)
+from app.checker.Checker import Checker, edited_article_ids
+from app.checker.ResolveEnum import ResolveEnum
+from app.utils.atlasdb import atlasdb
+
+A = atlasdb
+# name, smiles, source organism, npaid
+COMPOUNDS = (
+    ("Ethanol", "CCO", "Streptomyces albus", None),          # duplicate
+    ("Butanol", "CCCCO", "Streptomyces albus", None),        # flat match
+    ("Penicillin G", "CCCCCCO", "Streptomyces albus", None), # name match
+    ("Pentanol", "CCCCCO", "Streptomyces albus", None),      # no match
+    ("Phenol", "Oc1ccccc1", "Streptomyces albus", 8),        # unchanged
+    ("Cresol", "Cc1ccccc1O", "Streptomyces albus", 8),       # changed
+    ("Lost", "CCCCCCCO", "Streptomyces albus", 999),         # not in Atlas
+    ("Propanol", "CCCO", "Bad genus", None)
+)
+
+
+class CheckerRunBase(TestCase):
+    """
+    Checks a dataset in an in-memory curator database against an in-memory
+    Atlas
+    """
+
+    def create_app(self):
+        app = create_app('testing')
+        app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://')
+        return app
+
+    def setUp(self):
+        db.create_all()
+        self.engine = atlasdb.engine
+        atlasdb.engine = create_engine("sqlite://")
+        atlasdb.metadata.create_all(atlasdb.engine)
+        self.add_atlas()
+        self.dataset_id = self.add_dataset()
+
+    def tearDown(self):
+        atlasdb.engine = self.engine
+        db.session.remove()
+        db.drop_all()
+
+    def add_atlas(self):
+        sess = atlasdb.startSession()
+        sess.add_all([
+            A.Compound(id=1, inchi="x",
+                       inchikey="LFQSCWFLJHTTHZ-UHFFFAOYSA-N"),
+            # Butanol connectivity with other stereochemistry
+            A.Compound(id=2, inchi="x",
+                       inchikey="LRHPLDYGYMQRHN-ABCDEFGHSA-N"),
+            A.Compound(id=8, inchi="x",
+                       inchikey="ISWSIDIOOBJBQZ-UHFFFAOYSA-N"),
+            A.Name(id=1, name="Penicillin G")
+        ])
+        sess.commit()
+        sess.close()
+
+    def add_dataset(self, compounds=COMPOUNDS):
+        """One checked article per compound"""
+        db.session.add_all([
+            Genus(genus="Streptomyces", genustype="Bacterium"),
+            Journal(journal="Journal of Natural Products",
+                    abbrev="J. Nat. Prod.")])
+        articles = [
+            Article(doi="10.1021/np{}".format(i), pmid=i,
+                    journal="J. Nat. Prod.", year=2018,
+                    title="Title {}".format(i), authors="Some Authors",
+                    completed=True,
+                    compounds=[Compound(name=name, smiles=smiles,
+                                        source_organism=organism,
+                                        npaid=npaid)])
+            for i, (name, smiles, organism, npaid) in enumerate(compounds)
+        ]
+        curator = Curator(username="admin", password="admin2018")
+        dataset = Dataset(articles=articles, curator=curator, completed=True)
+        db.session.add(dataset)
+        db.session.flush()
+        db.session.add(CheckerDataset(dataset_id=dataset.id,
+                                      celery_task_id="x"))
+        db.session.commit()
+        return dataset.id
+
+    def checker(self, checker_class=Checker, **kwargs):
+        kwargs.setdefault("processes", 1)
+        return checker_class(self.dataset_id, **kwargs)
+
+    def problems(self):
+        """Saved (compound name or DOI, problem) pairs"""
+        problems = set()
+        for problem in Problem.query.filter_by(dataset_id=self.dataset_id):
+            if problem.compound_id:
+                label = Compound.query.get(problem.compound_id).name
+            else:
+                label = Article.query.get(problem.article_id).doi
+            problems.add((label, problem.problem))
+        return problems
+
+    def resolves(self):
+        return {x.name: x.checker_compound.resolve
+                for x in Compound.query}
+
+
+class QueryingChecker(Checker):
+    """Checker resolving every compound with its own Atlas queries, as
+    before the Atlas index
+    """
+
+    def compound_flat_match(self, compound):
+        sess = self.atlasdb.startSession()
+        res = sess.query(atlasdb.Compound)\
+            .filter(atlasdb.Compound.inchikey.startswith(
+                compound.inchikey.split('-')[0]))\
+            .first()
+        sess.close()
+        return bool(res)
+
+    def compound_full_match(self, compound):
+        sess = self.atlasdb.startSession()
+        res = sess.query(atlasdb.Compound)\
+            .filter(atlasdb.Compound.inchikey == compound.inchikey)\
+            .first()
+        sess.close()
+        return bool(res)
+
+    def compound_name_match(self, compound):
+        res = None
+        if compound.name != "Not named":
+            sess = self.atlasdb.startSession()
+            res = sess.query(atlasdb.Name)\
+                .filter(atlasdb.Name.name == compound.name)\
+                .first()
+            sess.close()
+        return bool(res)
+
+    def npaid_changed(self, compound):
+        sess = self.atlasdb.startSession()
+        res = sess.query(atlasdb.Compound)\
+            .filter_by(id=compound.npaid)\
+            .first()
+        sess.close()
+        return compound.inchikey != res.inchikey if res else True
+
+
+class TestAtlasResolution(CheckerRunBase):
+
+    def test_same_problems_as_queries(self):
+        self.checker(QueryingChecker).run()
+        queried = self.problems(), self.resolves()
+        for preload_atlas in (False, True):
+            self.checker(preload_atlas=preload_atlas).run()
+            self.assertEqual((self.problems(), self.resolves()), queried)
+
+    def test_problems(self):
+        self.checker().run()
+        self.assertEqual(
+            {x for x in self.problems() if x[1] != "genus"},
+            {("Ethanol", "duplicate"), ("Butanol", "flat_match"),
+             ("Penicillin G", "name_match"), ("Cresol", "flat_match"),
+             ("Lost", "flat_match")})
+        self.assertIn(("Propanol", "genus"), self.problems())
+        self.assertEqual(self.resolves()["Phenol"], ResolveEnum.update.value)
+
+
+class FailingChecker(Checker):
+    """Checker failing on the compound named fail_on"""
+
+    fail_on = "Penicillin G"
+
+    def create_checker_compound(self, db_compound, **kwargs):
+        if db_compound.name == self.fail_on:
+            raise RuntimeError("Failed on {}".format(db_compound.name))
+        return super(FailingChecker, self).create_checker_compound(
+            db_compound, **kwargs)
+
+
+class TestBatchRollback(CheckerRunBase):
+
+    def checked(self):
+        return [bool(x.checker_article and x.compounds[0].checker_compound)
+                for x in Dataset.query.get(self.dataset_id).articles]
+
+    def test_failing_batch(self):
+        with self.assertRaises(RuntimeError):
+            self.checker(FailingChecker, batch_size=2).run()
+        db.session.expire_all()
+        # Only the batch of the failing third article was rolled back
+        self.assertEqual(self.checked(),
+                         [True, True, False, False] + [False] * 4)
+        self.assertEqual(Problem.query.count(), 0)
+
+        checker = self.checker(batch_size=2)
+        checker.run(restart=True)
+        self.assertEqual(self.checked(), [True] * 8)
+        # Compounds of the failed run were never checked, so none count as
+        # unchanged and their problems are found again
+        self.assertEqual(checker.unchanged, set())
+        resumed = self.problems()
+        self.assertIn(("Ethanol", "duplicate"), resumed)
+
+        self.checker().run()
+        self.assertEqual(self.problems(), resumed)
+
+
+class TestRestart(CheckerRunBase):
+
+    def compound(self, name):
+        return Compound.query.filter_by(name=name).first()
+
+    def test_unchanged_skipped(self):
+        self.checker().run()
+        first = self.problems()
+        checker = self.checker()
+        checker.run(restart=True)
+        self.assertEqual(checker.unchanged, {x.id for x in Compound.query})
+        # Nothing was computed again and every problem was kept
+        self.assertEqual(checker.structures, {})
+        self.assertEqual(self.problems(), first)
+
+    def test_changed_rechecked(self):
+        self.checker().run()
+        # A new structure, name and organism for three compounds
+        self.compound("Pentanol").smiles = "CCO"
+        self.compound("Butanol").name = "Penicillin G"
+        self.compound("Propanol").source_organism = "Streptomyces albus"
+        db.session.commit()
+        changed = {self.compound(x).id for x in ("Pentanol", "Propanol")}
+        changed.add(Compound.query.filter_by(smiles="CCCCO").first().id)
+
+        checker = self.checker()
+        checker.run(restart=True)
+        self.assertEqual(set(checker.structures), changed)
+        self.assertEqual(
+            checker.unchanged, {x.id for x in Compound.query} - changed)
+        problems = {(Compound.query.get(x.compound_id).smiles, x.problem)
+                    for x in Problem.query if x.compound_id}
+        self.assertIn(("CCO", "duplicate"), problems)
+        self.assertIn(("CCCCO", "name_match"), problems)
+        self.assertIn(("CCCCO", "flat_match"), problems)
+        self.assertNotIn(("CCCO", "genus"), problems)
+        self.assertEqual(self.compound("Pentanol").checker_compound.smiles,
+                         "CCO")
+
+
+class TestIncremental(CheckerRunBase):
+
+    def setUp(self):
+        super(TestIncremental, self).setUp()
+        self.checker().run()
+        self.backdate()
+
+    def backdate(self):
+        """Move the last check and every edit before any edit in a test"""
+        for model in (Article, Compound):
+            db.session.execute(model.__table__.update()
+                               .values(last_edit_date=datetime(2000, 1, 1)))
+        db.session.execute(CheckerDataset.__table__.update()
+                           .values(last_check_date=datetime(2000, 1, 2)))
+        db.session.commit()
+
+    def article(self, name):
+        return Compound.query.filter_by(name=name).first().article[0]
+
+    def test_edited_ids(self):
+        ids = [x.id for x in Article.query]
+        self.assertEqual(edited_article_ids(ids, datetime(2000, 1, 2)), set())
+        self.article("Ethanol").title = "New title"
+        Compound.query.filter_by(name="Butanol").first().smiles = "CCCCCO"
+        db.session.commit()
+        self.assertEqual(edited_article_ids(ids, datetime(2000, 1, 2)),
+                         {self.article("Ethanol").id,
+                          self.article("Butanol").id})
+
+    def test_edited_article(self):
+        article = self.article("Ethanol")
+        doi = article.doi
+        # Rules run again even for a checker article marked resolved
+        article.checker_article.resolved = True
+        db.session.commit()
+        article.journal = "Bad Journal"
+        db.session.commit()
+
+        self.checker().run(incremental=True)
+        self.assertIn((doi, "journal"), self.problems())
+        article = self.article("Ethanol")
+        self.assertEqual(article.checker_article.journal, "Bad Journal")
+        self.assertFalse(article.checker_article.resolved)
+
+        self.backdate()
+        self.article("Ethanol").journal = "J. Nat. Prod."
+        db.session.commit()
+        self.checker().run(incremental=True)
+        self.assertNotIn((doi, "journal"), self.problems())
+        self.assertEqual(self.article("Ethanol").checker_article.journal,
+                         "Journal of Natural Products")
+
+    def test_unedited_carried_over(self):
+        first = self.problems()
+        # Would clear the duplicate if the Ethanol article were re-checked
+        sess = atlasdb.startSession()
+        sess.query(A.Compound).filter_by(id=1).delete()
+        sess.commit()
+        sess.close()
+
+        checker = self.checker()
+        checker.run(incremental=True)
+        self.assertEqual(checker.structures, {})
+        self.assertEqual(self.problems(), first)
+
+    def test_removed_compound(self):
+        first = self.problems()
+        article = self.article("Butanol")
+        article.compounds.pop()
+        article.last_edit_date = db.func.current_timestamp()
+        db.session.commit()
+
+        self.checker().run(incremental=True)
+        self.assertEqual(self.problems(), first - {("Butanol", "flat_match")})
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+import tempfile
+
+from flask_testing import TestCase
+from sqlalchemy import create_engine
+
+from app import create_app, db
+from app.models import (Article, CheckerArticle, CheckerCompound,
+                        CheckerDataset, Compound, Curator, Dataset, Genus)
+from app.checker.ChangeLog import ChangeLogIndex
+from app.checker.Inserter import Inserter
+from app.checker.ResolveEnum import ResolveEnum
+from app.checker.views import plan_dataset_insert
+from app.utils.atlasdb import atlasdb
+from app.utils.Compound import Compound as StructureCompound
+
+A = atlasdb
+NEW_COMPOUNDS = (("Propanol", "CCCO", "Streptomyces", "albus"),
+                 ("Butanol", "CCCCO", "Aspergillus", "niger"),
+                 ("Pentanol", "CCCCCO", "Streptomyces", "albus"))
+
+
+class TestInserter(TestCase):
+    """
+    Inserts into an in-memory Atlas from an in-memory curator database
+    """
+
+    def create_app(self):
+        app = create_app('testing')
+        app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://')
+        return app
+
+    def setUp(self):
+        db.create_all()
+        self.engine = atlasdb.engine
+        atlasdb.engine = create_engine("sqlite://")
+        atlasdb.metadata.create_all(atlasdb.engine)
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.add_atlas()
+        self.dataset_id = self.add_dataset()
+
+    def tearDown(self):
+        atlasdb.engine = self.engine
+        self.log_dir.cleanup()
+        db.session.remove()
+        db.drop_all()
+
+    def add_atlas(self):
+        sess = atlasdb.startSession()
+        genus = A.Genus(id=1, name="Streptomyces", origin_type_id=1)
+        origin = A.Origin(id=1, genus=genus, species="griseus")
+        reference = A.Reference(id=1, journal=A.Journal(id=1,
+                                title="J. Nat. Prod."),
+                                reference_type_id=1, title="Old")
+        phenol = A.Compound(id=8, inchi="x",
+                            inchikey="ISWSIDIOOBJBQZ-UHFFFAOYSA-N",
+                            molecular_weight=1, accurate_mass=1,
+                            m_plus_H=1, m_plus_Na=1)
+        sess.add_all([A.OriginType(id=1, name="Bacterium"),
+                      A.OriginType(id=2, name="Fungus"),
+                      A.ReferenceType(id=1, name="Journal Article"),
+                      genus, origin, reference, phenol])
+        sess.flush()
+        sess.add_all([
+            A.CompoundName(compound=phenol, name=A.Name(name="Phenol old"),
+                           reference=reference, original_isolation_name=1),
+            A.CompoundOrigin(compound=phenol, origin=origin,
+                             reference=reference,
+                             original_isolation_reference=1)
+        ])
+        sess.commit()
+        sess.close()
+
+    def add_dataset(self):
+        """Three checked articles of one new compound each, the first
+        also updating Atlas compound 8
+        """
+        db.session.add_all([Genus(genus="Streptomyces", genustype="Bacterium"),
+                            Genus(genus="Aspergillus", genustype="Fungus")])
+        articles = []
+        for i, (name, smiles, genus, species) in enumerate(NEW_COMPOUNDS):
+            compounds = [self.add_compound(name, smiles, genus, species)]
+            if i == 0:
+                compounds.append(self.add_compound(
+                    "Phenol", "c1ccccc1O", "Streptomyces", "griseus",
+                    npaid=8, resolve=ResolveEnum.replace.value))
+            article = Article(doi="10.1021/np{}".format(i), completed=True,
+                              compounds=compounds)
+            article.checker_article = CheckerArticle(
+                doi=article.doi, journal="J. Nat. Prod.", year=2018,
+                title="Title {}".format(i), authors="Some Authors")
+            articles.append(article)
+        curator = Curator(username="admin", password="admin2018")
+        dataset = Dataset(articles=articles, curator=curator, completed=True)
+        db.session.add(dataset)
+        db.session.flush()
+        db.session.add(CheckerDataset(dataset_id=dataset.id,
+                                      celery_task_id="x", standardized=True,
+                                      completed=True))
+        db.session.commit()
+        return dataset.id
+
+    @staticmethod
+    def add_compound(name, smiles, genus, species, npaid=None,
+                     resolve=ResolveEnum.new.value):
+        compound = Compound(name=name, smiles=smiles,
+                            source_organism="{} {}".format(genus, species))
+        compound.checker_compound = CheckerCompound(
+            name=name, smiles=smiles, source_genus=genus,
+            source_species=species, npaid=npaid, resolve=resolve,
+            inchikey=StructureCompound(smiles).inchikey)
+        return compound
+
+    def inserter(self, **kwargs):
+        return Inserter(self.dataset_id, logger=self.app.logger,
+                        log_dir=self.log_dir.name, **kwargs)
+
+    def atlas_rows(self):
+        sess = atlasdb.startSession()
+        rows = {
+            "compounds": sorted((x.inchikey, x.smiles)
+                                for x in sess.query(A.Compound)),
+            "names": sorted(x.name for x in sess.query(A.Name)),
+            "origins": sorted((x.genus.name, x.species)
+                              for x in sess.query(A.Origin)),
+            "references": sorted(x.doi or "" for x in sess.query(A.Reference))
+        }
+        sess.close()
+        return rows
+
+    def test_plan_digest_stable(self):
+        before = self.atlas_rows()
+        first = self.inserter().plan()
+        self.assertEqual(self.inserter().plan()["digest"], first["digest"])
+        self.assertEqual(self.atlas_rows(), before)
+
+    def test_plan_matches_run(self):
+        plan = self.inserter().plan()
+        before = self.atlas_rows()
+        self.inserter().run(digest=plan["digest"])
+        after = self.atlas_rows()
+
+        planned = [x["object"].split()[1] for x in plan["inserts"]]
+        self.assertEqual(
+            len(after["compounds"]) - len(before["compounds"]),
+            planned.count("Compound"))
+        self.assertEqual(len(after["names"]) - len(before["names"]),
+                         planned.count("Name"))
+        self.assertEqual(len(after["origins"]) - len(before["origins"]),
+                         planned.count("Origin"))
+        self.assertEqual(
+            len(after["references"]) - len(before["references"]),
+            planned.count("Reference"))
+
+        updates = {(x["object"], x["attribute"]): x["new_value"]
+                   for x in plan["updates"]}
+        sess = atlasdb.startSession()
+        phenol = sess.query(A.Compound).get(8)
+        self.assertEqual(updates[("Compound 8", "smiles")], phenol.smiles)
+        self.assertEqual(updates[("Compound 8", "inchi")], phenol.inchi)
+        sess.close()
+        self.assertTrue(Dataset.query.get(self.dataset_id).inserted())
+
+    def test_plan_task(self):
+        result = plan_dataset_insert.apply(args=(self.dataset_id,)).get()
+        self.assertEqual(result["result"], self.inserter().plan())
+
+        compound = Compound.query.filter_by(name="Butanol").first()
+        compound.checker_compound.resolve = 42
+        db.session.commit()
+        result = plan_dataset_insert.apply(args=(self.dataset_id,)).get()
+        self.assertNotIn("result", result)
+        self.assertIn("42", result["error"])
+
+    def test_digest_mismatch(self):
+        plan = self.inserter().plan()
+        sess = atlasdb.startSession()
+        sess.add(A.Name(name="Butanol"))
+        sess.commit()
+        sess.close()
+        before = self.atlas_rows()
+        with self.assertRaises(RuntimeError):
+            self.inserter().run(digest=plan["digest"])
+        self.assertEqual(self.atlas_rows(), before)
+
+    def test_prefetch_origins_chunked(self):
+        pentanol = Compound.query.filter_by(name="Pentanol").first()
+        pentanol.checker_compound.source_species = None
+        db.session.commit()
+        articles = Dataset.query.get(self.dataset_id).articles
+        sess = atlasdb.startSession()
+        inserter = self.inserter(chunk_size=1)
+        inserter.prefetch(articles, sess)
+        sess.close()
+        self.assertEqual(set(inserter.origins), {("streptomyces", "griseus")})
+
+    def test_failing_chunk_rolled_back(self):
+        failing = Article.query.filter_by(doi="10.1021/np2").first()
+        failing.compounds[0].checker_compound.resolve = \
+            ResolveEnum.reject.value
+        db.session.commit()
+        before = self.atlas_rows()
+        with self.assertRaises(RuntimeError):
+            self.inserter(articles_per_commit=3).run()
+
+        # Nothing of the failing chunk was committed or logged
+        self.assertEqual(self.atlas_rows(), before)
+        self.assertEqual(
+            [x.inserted for x in Dataset.query.get(self.dataset_id).articles],
+            [False, False, False])
+        index = ChangeLogIndex.from_dir(self.log_dir.name)
+        self.assertEqual(index.reference(2), [])
+
+    def test_resume_after_failure(self):
+        # The last article fails after the first two were committed
+        failing = Article.query.filter_by(doi="10.1021/np2").first()
+        failing.compounds[0].checker_compound.resolve = \
+            ResolveEnum.reject.value
+        db.session.commit()
+        with self.assertRaises(RuntimeError):
+            self.inserter(articles_per_commit=1).run()
+
+        articles = Dataset.query.get(self.dataset_id).articles
+        self.assertEqual([x.inserted for x in articles], [True, True, False])
+        self.assertTrue(all(x.npa_artid for x in articles[:2]))
+        self.assertEqual(
+            [x.npa_artid for x in articles[:2]],
+            [x.checker_article.npa_artid for x in articles[:2]])
+        self.assertEqual(len(self.atlas_rows()["references"]), 3)
+
+        failing.compounds[0].checker_compound.resolve = ResolveEnum.new.value
+        db.session.commit()
+        self.inserter(articles_per_commit=1).run()
+
+        rows = self.atlas_rows()
+        self.assertEqual(rows["references"],
+                         ["", "10.1021/np0", "10.1021/np1", "10.1021/np2"])
+        self.assertEqual(len(rows["compounds"]), 4)
+        self.assertEqual(rows["origins"], [("Aspergillus", "niger"),
+                                           ("Streptomyces", "albus"),
+                                           ("Streptomyces", "griseus")])
+        self.assertEqual(
+            [x.inserted for x in Dataset.query.get(self.dataset_id).articles],
+            [True, True, True])
+
+        # Both runs logged what they committed, once
+        index = ChangeLogIndex.from_dir(self.log_dir.name)
+        for article in Dataset.query.get(self.dataset_id).articles:
+            self.assertEqual(
+                [x["action"] for x in index.reference(article.npa_artid)],
+                ["insert"])
+        self.assertEqual(index.compound(8)[0]["attribute"], "inchi")
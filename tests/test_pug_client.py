@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from aiohttp import web
+
+from app.utils.DiskCache import DiskCache
+from app.utils.PugClient import RateLimiter, standardize_smiles_batch
+from app.utils.timeout import deadline
+
+WAITING = """<PCT-Data>
+  <PCT-Status-Message>
+    <PCT-Status value="success"/>
+  </PCT-Status-Message>
+  <PCT-Waiting>
+    <PCT-Waiting_reqid>{0}</PCT-Waiting_reqid>
+  </PCT-Waiting>
+</PCT-Data>"""
+
+RUNNING = """<PCT-Data>
+  <PCT-Status-Message>
+    <PCT-Status value="running"/>
+  </PCT-Status-Message>
+</PCT-Data>"""
+
+DONE = """<PCT-Data>
+  <PCT-Status-Message>
+    <PCT-Status value="success"/>
+  </PCT-Status-Message>
+  <PCT-Structure_structure_string>{0}</PCT-Structure_structure_string>
+</PCT-Data>"""
+
+FAILED = """<PCT-Data>
+  <PCT-Status-Message>
+    <PCT-Status value="server-error"/>
+  </PCT-Status-Message>
+</PCT-Data>"""
+
+
+class StubPugServer(object):
+    """Minimal PUG gateway answering each job after one running poll
+
+    Structures containing "Cl" are rejected, everything else is returned
+    with a "std:" prefix
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.polls = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        body = await request.text()
+        if "<PCT-Request_reqid>" in body:
+            reqid = body.split("<PCT-Request_reqid>")[1].split("<")[0]
+            self.polls[reqid] += 1
+            smiles = self.jobs[reqid]
+            if "Cl" in smiles:
+                text = FAILED
+            elif self.polls[reqid] < 2:
+                text = RUNNING
+            else:
+                text = DONE.format("std:" + smiles)
+                self.in_flight -= 1
+        else:
+            smiles = body.split("<PCT-Structure_structure_string>")[1]\
+                .split("<")[0]
+            reqid = str(len(self.jobs))
+            self.jobs[reqid] = smiles
+            self.polls[reqid] = 0
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            text = WAITING.format(reqid)
+        return web.Response(text=text)
+
+    def start(self):
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            app = web.Application()
+            app.router.add_post("/pug/pug.cgi", self.handle)
+            self.runner = web.AppRunner(app)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, "127.0.0.1", 0)
+            self.loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        started.wait(5)
+        return "http://127.0.0.1:%s/pug/pug.cgi" % self.port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+class TestPugClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StubPugServer()
+        self.url = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def standardize(self, smiles_list, **kwargs):
+        kwargs.setdefault("poll_interval", 0.01)
+        kwargs.setdefault("rate", 1000)
+        kwargs.setdefault("cache", None)
+        return standardize_smiles_batch(smiles_list, url=self.url, **kwargs)
+
+    def test_standardize_many(self):
+        smiles = ["C" * i for i in range(1, 21)]
+        result = self.standardize(smiles)
+        self.assertEqual(result, {s: "std:" + s for s in smiles})
+
+    def test_duplicates_submitted_once(self):
+        result = self.standardize(["CCO", "CCO", "CCN"])
+        self.assertEqual(len(result), 2)
+        self.assertEqual(len(self.server.jobs), 2)
+
+    def test_failures(self):
+        result = self.standardize(["CCO", "CCCl", "C#C#C"])
+        self.assertEqual(result["CCO"], "std:CCO")
+        self.assertIsNone(result["CCCl"])
+        self.assertIsNone(result["C#C#C"])
+
+    def test_concurrency_limit(self):
+        smiles = ["C" * i for i in range(1, 21)]
+        self.standardize(smiles, concurrency=3)
+        self.assertLessEqual(self.server.max_in_flight, 3)
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_gives_up_after_max_retry(self):
+        result = self.standardize(["CCO"], max_retry=1)
+        self.assertIsNone(result["CCO"])
+
+    def test_shared_limiter(self):
+        class CountingLimiter(object):
+            calls = 0
+
+            async def acquire(self):
+                self.calls += 1
+
+        limiter = CountingLimiter()
+        self.standardize(["CCO", "CCN"], limiter=limiter)
+        self.assertEqual(limiter.calls, self.server.requests)
+
+    def test_unreachable(self):
+        self.server.stop()
+        result = self.standardize(["CCO"], timeout=1)
+        self.assertIsNone(result["CCO"])
+        self.server.start()
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DiskCache(os.path.join(tmpdir, "cache.sqlite"))
+            first = self.standardize(["CCO", "CCCl"], cache=cache)
+            requests = self.server.requests
+            second = self.standardize(["CCO", "CCCl"], cache=cache)
+            self.assertEqual(first, second)
+            self.assertIsNone(second["CCCl"])
+            self.assertEqual(self.server.requests, requests)
+
+    def test_unfinished_not_cached(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DiskCache(os.path.join(tmpdir, "cache.sqlite"))
+            self.standardize(["CCO"], cache=cache, max_retry=1)
+            self.assertEqual(len(cache), 0)
+            result = self.standardize(["CCO"], cache=cache)
+            self.assertEqual(result["CCO"], "std:CCO")
+
+    def test_deadline(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DiskCache(os.path.join(tmpdir, "cache.sqlite"))
+            start = time.monotonic()
+            with deadline(0.2):
+                result = self.standardize(["CCO"], cache=cache,
+                                          poll_interval=5)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertIsNone(result["CCO"])
+            self.assertEqual(len(cache), 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_rate(self):
+        async def run():
+            limiter = RateLimiter(20, burst=1)
+            for _ in range(6):
+                await limiter.acquire()
+
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
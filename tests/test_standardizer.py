@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append("..")
+import unittest
+
+from app.utils.Compound import structure_record, structure_records
+from app.utils.Standardizer import (HybridStandardizer, RDKitStandardizer,
+                                    Standardizer, get_standardizer,
+                                    same_compound)
+
+
+class RecordingStandardizer(Standardizer):
+    """Remote stand-in returning a marker for every structure"""
+
+    def __init__(self):
+        self.calls = []
+
+    def standardize_many(self, smiles_list):
+        self.calls.append(list(smiles_list))
+        return {s: "remote:" + s for s in smiles_list}
+
+
+class TestRDKitStandardizer(unittest.TestCase):
+    def setUp(self):
+        self.standardizer = RDKitStandardizer()
+
+    def test_tautomer(self):
+        self.assertEqual(self.standardizer.standardize("Oc1ccccn1"),
+                         "O=C1C=CC=CN1")
+
+    def test_normalization(self):
+        self.assertEqual(self.standardizer.standardize("CN(=O)=O"),
+                         "C[N+](=O)[O-]")
+
+    def test_kekule_output(self):
+        self.assertEqual(self.standardizer.standardize("c1ccccc1O"),
+                         "OC1=CC=CC=C1")
+
+    def test_keeps_stereo(self):
+        smiles = "C[C@H](N)C(=O)O"
+        self.assertTrue(same_compound(smiles,
+                                      self.standardizer.standardize(smiles)))
+
+    def test_invalid(self):
+        self.assertRaises(TypeError, self.standardizer.standardize, "C#C#C")
+        self.assertIsNone(self.standardizer.standardize_many(["C#C#C"])
+                          ["C#C#C"])
+
+
+class TestHybridStandardizer(unittest.TestCase):
+    def setUp(self):
+        self.remote = RecordingStandardizer()
+        self.standardizer = HybridStandardizer(RDKitStandardizer(),
+                                               self.remote)
+
+    def test_agreement_stays_local(self):
+        result = self.standardizer.standardize_many(["Oc1ccccn1", "CCO"])
+        self.assertEqual(result, {"Oc1ccccn1": "O=C1C=CC=CN1", "CCO": "CCO"})
+        self.assertEqual(self.remote.calls, [])
+
+    def test_failure_goes_remote(self):
+        result = self.standardizer.standardize_many(["CCO", "C#C#C"])
+        self.assertEqual(result["C#C#C"], "remote:C#C#C")
+        self.assertEqual(self.remote.calls, [["C#C#C"]])
+
+
+class TestGetStandardizer(unittest.TestCase):
+    def test_names(self):
+        self.assertIsInstance(get_standardizer("rdkit"), RDKitStandardizer)
+        self.assertIsInstance(get_standardizer("hybrid"), HybridStandardizer)
+        self.assertEqual(get_standardizer("pubchem").name, "pubchem")
+        self.assertRaises(ValueError, get_standardizer, "unknown")
+
+    def test_structure_record_standardizer(self):
+        record = structure_record("c1ccccc1O", standardize=True,
+                                  standardizer=RDKitStandardizer())
+        self.assertEqual(record.smiles, "OC1=CC=CC=C1")
+
+
+class CountingStandardizer(RDKitStandardizer):
+    """RDKit backend recording every batch it is given"""
+
+    def __init__(self):
+        super(CountingStandardizer, self).__init__()
+        self.calls = []
+
+    def standardize_many(self, smiles_list):
+        self.calls.append(list(smiles_list))
+        return super(CountingStandardizer, self).standardize_many(
+            smiles_list)
+
+
+class TestStructureRecords(unittest.TestCase):
+    JOBS = [("c1ccccc1O", "phenol", True), ("CCO", "ethanol", False),
+            ("Oc1ncccc1", "pyridinol", True),
+            ("CC(=O)[O-].c1ccccc1O.[Na+]", "salt", True)]
+
+    def test_batched(self):
+        standardizer = CountingStandardizer()
+        records = structure_records(self.JOBS, processes=2,
+                                    standardizer=standardizer)
+        # One batch before the pool and one for the fragments removed
+        self.assertEqual(standardizer.calls,
+                         [["c1ccccc1O", "Oc1ncccc1",
+                           "CC(=O)[O-].c1ccccc1O.[Na+]"],
+                          ["Oc1ccccc1"]])
+        self.assertEqual(records, [
+            structure_record(smiles, name=name, standardize=standardize,
+                             standardizer=RDKitStandardizer())
+            for smiles, name, standardize in self.JOBS])
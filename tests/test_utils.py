@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 import sys
 sys.path.append("..")
+import os
+import pickle
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
+import billiard
+from rdkit import Chem
+
+from app.utils.DiskCache import DiskCache
+from app.utils.adducts import (FORMATE_ION_MASS, PROTON_MASS,
+                               SODIUM_ION_MASS, adduct_mz, adduct_table)
 from app.utils.NoneDict import NoneDict
-from app.utils.timeout import exit_after
+from app.utils.Compound import Compound, structure_records
+from app.utils.StructureCleaner import structure_cleaner
+from app.utils.StructureRecord import StructureRecord
+from app.utils.SuggestionIndex import SuggestionIndex, suggestion_key
+from app.utils.timeout import (DeadlineExceeded, check_deadline, deadline,
+                               exit_after, request_timeout, with_deadline)
 from app.utils.pubchem_smiles_standardizer import get_standardized_smiles
 
 import traceback
@@ -58,6 +73,147 @@ class TestNoneDict(MyTestCase):
         self.assertIsNone(self.d[3])
 
 
+class TestDiskCache(MyTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(os.path.join(self.tmpdir.name, "cache.sqlite"),
+                               namespace="test", max_entries=10)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_set(self):
+        key = DiskCache.make_key("C", "O")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, {"inchikey": "ABC"})
+        self.assertEqual(self.cache.get(key), {"inchikey": "ABC"})
+
+    def test_namespaces(self):
+        other = DiskCache(self.cache.path, namespace="other")
+        self.cache.set("key", 1)
+        self.assertIsNone(other.get("key"))
+
+    def test_lru_eviction(self):
+        for i in range(12):
+            self.cache.set(str(i), i)
+            # Keep the first entry recently used
+            self.cache.get("0")
+        self.assertEqual(len(self.cache), 10)
+        self.assertEqual(self.cache.get("0"), 0)
+        self.assertIsNone(self.cache.get("1"))
+
+    def test_ttl(self):
+        self.cache.set("fresh", 1)
+        self.cache.set("stale", 2, ttl=-1)
+        self.assertEqual(self.cache.get("fresh"), 1)
+        self.assertIsNone(self.cache.get("stale"))
+        self.assertEqual(len(self.cache), 1)
+
+    def test_unavailable(self):
+        cache = DiskCache("/proc/nope/cache.sqlite")
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(cache.get("key"))
+            cache.set("key", 1)
+        self.assertIsNone(cache.get("key"))
+
+    def test_batched_access_times(self):
+        self.cache.set("key", 1)
+        changes = self.cache.conn.total_changes
+        for _ in range(5):
+            self.assertEqual(self.cache.get("key"), 1)
+        self.assertEqual(self.cache.conn.total_changes, changes)
+
+
+class TestStructureCleaner(MyTestCase):
+    def clean(self, smiles):
+        mol, neutralized, defragmented = structure_cleaner.clean(
+            Chem.MolFromSmiles(smiles))
+        return Chem.MolToSmiles(mol), neutralized, defragmented
+
+    def test_neutralize(self):
+        self.assertEqual(self.clean("CC(=O)[O-]"), ("CC(=O)O", True, False))
+        self.assertEqual(self.clean("C[NH3+]"), ("CN", True, False))
+        # Nitro groups and quaternary amines keep their charges
+        self.assertEqual(self.clean("C[N+](=O)[O-]"),
+                         ("C[N+](=O)[O-]", False, False))
+
+    def test_keeps_stereo(self):
+        self.assertEqual(self.clean("CC[C@H]([NH3+])C(=O)[O-]")[0],
+                         "CC[C@H](N)C(=O)O")
+
+    def test_salts_and_fragments(self):
+        self.assertEqual(self.clean("CC(=O)[O-].[Na+]"),
+                         ("CC(=O)O", True, True))
+        self.assertEqual(self.clean("CCCCCC.CO")[0], "CCCCCC")
+        self.assertEqual(self.clean("CO.CCCCCC")[0], "CCCCCC")
+
+    def test_clean_many(self):
+        mols = [Chem.MolFromSmiles(x) for x in ("CCO", "C[NH3+]")]
+        results = structure_cleaner.clean_many(mols)
+        self.assertEqual([r[1] for r in results], [False, True])
+
+    def test_compound_clean_structure(self):
+        compound = Compound("CC[C@H]([NH3+])C(=O)[O-].[Cl-]", cache=None)
+        compound.cleanStructure()
+        self.assertEqual(compound.smiles, "CC[C@H](N)C(=O)O")
+        self.assertEqual(compound.formula, "C4H9NO2")
+
+
+class TestCompoundProperties(MyTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(os.path.join(self.tmpdir.name, "cache.sqlite"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lazy(self):
+        compound = Compound("CCO", cache=None)
+        self.assertEqual(compound.inchikey, "LFQSCWFLJHTTHZ-UHFFFAOYSA-N")
+        self.assertEqual(set(compound._props), {"inchikey"})
+
+    def test_molblock_name(self):
+        compound = Compound("CCO", name="ethanol", cache=None)
+        self.assertTrue(compound.molblock.startswith("ethanol\n"))
+        compound.name = "alcohol"
+        self.assertTrue(compound.molblock.startswith("alcohol\n"))
+
+    def test_invalidated_by_clean_structure(self):
+        compound = Compound("CC(=O)[O-]", cache=None)
+        self.assertEqual(compound.formula, "C2H3O2-")
+        compound.cleanStructure()
+        self.assertEqual(compound.formula, "C2H4O2")
+
+    def test_clean_structure_copies(self):
+        compound = Compound("CCO", cache=self.cache)
+        compound.formula
+        mol = compound.rdmol
+        compound.cleanStructure()
+        # Cleanup works on a copy and the memo starts over
+        self.assertIsNot(compound.rdmol, mol)
+        self.assertIsNone(compound._props)
+        self.assertIsNone(compound._cache_key)
+        self.assertEqual(compound.formula, "C2H6O")
+
+    def test_cache_collects_properties(self):
+        first = Compound("CCO", cache=self.cache)
+        first.inchikey
+        first.saveMolprops()
+        Compound("OCC", cache=self.cache).formula
+        compound = Compound("CCO", cache=self.cache)
+        compound.calcMolprops()
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(compound.mass, 46.069)
+        self.assertEqual(compound.m_plus_h, 47.0492)
+
+    def test_cache_written_once(self):
+        changes = self.cache.conn.total_changes
+        Compound("CCO", cache=self.cache).to_record()
+        self.assertEqual(self.cache.conn.total_changes - changes, 1)
+        Compound("OCC", cache=self.cache).to_record()
+        self.assertEqual(self.cache.conn.total_changes - changes, 1)
+
+
 class TestTimeout(MyTestCase):
 
     @exit_after(1)
@@ -74,6 +230,44 @@ class TestTimeout(MyTestCase):
         self.assertNotRaises(KeyboardInterrupt, self.timein, 0.5)
 
 
+class TestDeadline(MyTestCase):
+
+    @with_deadline(0.3)
+    def cooperative(self, cs):
+        counter = 0.
+        while counter < cs:
+            check_deadline()
+            sleep(0.05)
+            counter += 0.05
+
+    def test_overtime(self):
+        self.assertRaises(DeadlineExceeded, self.cooperative, 1)
+
+    def test_undertime(self):
+        self.assertNotRaises(DeadlineExceeded, self.cooperative, 0.1)
+
+    def test_worker_threads(self):
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(self.cooperative, t)
+                       for t in (0.1, 1, 0.1, 1)]
+        errors = [f.exception() for f in futures]
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], DeadlineExceeded)
+        self.assertIsNone(errors[2])
+        self.assertIsInstance(errors[3], DeadlineExceeded)
+
+    def test_request_timeout(self):
+        self.assertEqual(request_timeout(30), 30)
+        with deadline(5):
+            self.assertLessEqual(request_timeout(30), 5)
+            # Nested deadlines can not extend the outer one
+            with deadline(60):
+                self.assertLessEqual(request_timeout(30), 5)
+            self.assertLessEqual(request_timeout(1), 1)
+        with deadline(0):
+            self.assertRaises(DeadlineExceeded, request_timeout, 30)
+
+
 
 class TestPubChemStandardize(unittest.TestCase):
 
@@ -90,3 +284,99 @@ class TestPubChemStandardize(unittest.TestCase):
         smiles = "c12c3c4c5c1c1c6c7c2c2c8c3c3c9c4c4c%10c5c5c1c1c6c6c%11c7c2c2c7c8c3c3c8c9c4c4c9c%10c5c5c1c1c6c6c%11c2c2c7c3c3c8c4c4c9c5c1c1c6c2c3c41"
         expected_smiles = "C12=C3C4=C5C6=C1C7=C8C9=C1C%10=C%11C(=C29)C3=C2C3=C4C4=C5C5=C9C6=C7C6=C7C8=C1C1=C8C%10=C%10C%11=C2C2=C3C3=C4C4=C5C5=C%11C%12=C(C6=C95)C7=C1C1=C%12C5=C%11C4=C3C3=C5C(=C81)C%10=C23"
         self.assertEqual(get_standardized_smiles(smiles), expected_smiles)
+
+
+class TestAdducts(unittest.TestCase):
+    def test_masses_match_rdkit(self):
+        from rdkit.Chem import Descriptors
+        for smiles, mass in (("[H+]", PROTON_MASS),
+                             ("[Na+]", SODIUM_ION_MASS),
+                             ("[O-]C=O", FORMATE_ION_MASS)):
+            self.assertAlmostEqual(
+                Descriptors.ExactMolWt(Chem.MolFromSmiles(smiles)), mass,
+                places=9)
+
+    def test_adduct_mz(self):
+        self.assertEqual(adduct_mz(46.0419, "[M+H]+"), 47.0492)
+        self.assertEqual(adduct_mz(46.0419, "[M-H]-"), 45.0346)
+        self.assertEqual(adduct_mz(46.0419, "[M+2H]2+"), 24.0282)
+        self.assertEqual(adduct_mz(46.0419, "[2M+Na]+"), 115.0730)
+
+    def test_adduct_table(self):
+        masses = [46.0419, 180.0634]
+        adducts = ["[M+H]+", "[M+Na]+", "[M-H]-"]
+        table = adduct_table(masses, adducts)
+        self.assertEqual(table.shape, (2, 3))
+        for i, mass in enumerate(masses):
+            for j, adduct in enumerate(adducts):
+                self.assertEqual(table[i, j], adduct_mz(mass, adduct))
+
+
+class TestStructureRecord(unittest.TestCase):
+    def test_from_compound(self):
+        record = Compound("CCO", name="ethanol", cache=None).to_record()
+        self.assertEqual(record.inchikey, "LFQSCWFLJHTTHZ-UHFFFAOYSA-N")
+        self.assertEqual(record.m_plus_h, 47.0492)
+        self.assertTrue(record.molblock.startswith("ethanol\n"))
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def test_pickle(self):
+        record = StructureRecord(name="ethanol", smiles="CCO")
+        copy = pickle.loads(pickle.dumps(record))
+        self.assertEqual(copy, record)
+        self.assertIsNone(copy.inchi)
+
+    def test_unknown_field(self):
+        self.assertRaises(TypeError, StructureRecord, rdmol=None)
+
+    def test_structure_records_daemon(self):
+        # Celery prefork workers are daemonic processes
+        jobs = [(x, "Unknown", False) for x in ("CCO", "c1ccccc1O", "CCCC")]
+        queue = billiard.Queue()
+
+        def work():
+            with self.assertRaises(AssertionError):
+                # No warning about falling back to running serially
+                with self.assertLogs(level="WARNING"):
+                    records = structure_records(jobs, processes=2)
+            queue.put(records)
+
+        worker = billiard.Process(target=work, daemon=True)
+        worker.start()
+        records = queue.get(timeout=60)
+        worker.join()
+        self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(records, structure_records(jobs, processes=1))
+
+
+class TestSuggestionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SuggestionIndex()
+        for genus in ["Streptomyces", "Streptococcus", "Aspergillus",
+                      "Penicillium", "Bacillus"]:
+            self.index.add(genus, genus)
+        self.index.add("Streptomyes", "Streptomyces")
+
+    def test_suggest(self):
+        suggestions = self.index.suggest("Streptomyses")
+        self.assertEqual(suggestions[0], "Streptomyces")
+        self.assertNotIn("Aspergillus", suggestions)
+
+    def test_value_once(self):
+        self.assertEqual(self.index.suggest("Streptomyes").count(
+            "Streptomyces"), 1)
+
+    def test_no_match(self):
+        self.assertEqual(self.index.suggest("Xyz"), [])
+        self.assertEqual(self.index.suggest(""), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.suggest("Strepto", limit=1,
+                                                cutoff=0)), 1)
+
+    def test_key(self):
+        self.assertEqual(suggestion_key(" J.  Nat.Prod. "), "j nat prod")
+        index = SuggestionIndex()
+        index.add("J. Nat. Prod.", "Journal of Natural Products")
+        self.assertEqual(index.suggest("J Nat Prod"),
+                         ["Journal of Natural Products"])